@@ -0,0 +1,103 @@
+import binascii
+
+from django.conf import settings
+from django.core.files.uploadedfile import TemporaryUploadedFile
+from django.utils.encoding import filepath_to_uri
+
+from PIL import Image
+from recipes.images import variant_names
+from recipes.storage import content_hash, hash_of, image_storage
+from rest_framework import serializers
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на уменьшенные копии картинки рецепта; пока копии
+    не готовы, все ссылки ведут на исходную картинку."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        if not recipe.image:
+            return None
+        names = variant_names(recipe.image.name)
+        if not recipe.has_image_variants:
+            names = dict.fromkeys(names, recipe.image.name)
+        return {key: self.absolute_url(name) for key, name in names.items()}
+
+    def absolute_url(self, name):
+        """То же, что request.build_absolute_uri(image_storage.url(name)),
+        но адрес каталога картинок вычисляется один раз на ответ."""
+        if 'media_url' not in self.context:
+            request = self.context.get('request')
+            url = image_storage.base_url
+            self.context['media_url'] = (
+                request.build_absolute_uri(url) if request else url
+            )
+        return self.context['media_url'] + filepath_to_uri(name).lstrip('/')
+
+
+class RecipeImageField(serializers.ImageField):
+    """Картинка рецепта: файл из multipart/form-data или строка base64
+    (data:image/png;base64,...).
+
+    Размер строки проверяется до декодирования, а декодируется она
+    частями во временный файл. Картинка, совпадающая с текущей картинкой
+    рецепта, не проверяется и не сохраняется заново.
+    """
+    default_error_messages = {
+        'too_large': 'Картинка не должна быть больше {max_size} байт.',
+        'invalid_base64': 'Картинка должна быть файлом или строкой base64.',
+    }
+    formats = {'JPEG': 'jpg', 'PNG': 'png', 'GIF': 'gif'}
+    chunk_size = 64 * 1024
+
+    def to_internal_value(self, data):
+        if isinstance(data, str):
+            data = self.decode(data)
+        elif getattr(data, 'size', 0) > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.fail('too_large', max_size=settings.RECIPE_IMAGE_MAX_SIZE)
+        current = getattr(self.parent.instance, 'image', None)
+        if (current and hasattr(data, 'chunks')
+                and content_hash(data) == hash_of(current.name)):
+            return current
+        return super().to_internal_value(data)
+
+    def decode_chunks(self, data, start):
+        """Декодирует base64 по частям. Пробелы и переводы строк (MIME
+        переносит строку каждые 76 символов) из частей убираются, а
+        остаток, не кратный четырём символам, переносится в следующую
+        часть."""
+        rest = ''
+        for position in range(start, len(data), self.chunk_size):
+            chunk = rest + ''.join(
+                data[position:position + self.chunk_size].split()
+            )
+            end = len(chunk) - len(chunk) % 4
+            rest = chunk[end:]
+            yield binascii.a2b_base64(chunk[:end])
+        yield binascii.a2b_base64(rest)
+
+    def decode(self, data):
+        start = data.find(';base64,')
+        start = 0 if start == -1 else start + len(';base64,')
+        if (len(data) - start) * 3 // 4 > settings.RECIPE_IMAGE_MAX_SIZE:
+            self.fail('too_large', max_size=settings.RECIPE_IMAGE_MAX_SIZE)
+        file = TemporaryUploadedFile('image', None, 0, None)
+        try:
+            for chunk in self.decode_chunks(data, start):
+                file.write(chunk)
+            file.size = file.tell()
+            file.seek(0)
+            image_format = Image.open(file).format
+        except (binascii.Error, OSError, ValueError):
+            file.close()
+            self.fail('invalid_base64')
+        if image_format not in self.formats:
+            file.close()
+            self.fail('invalid_image')
+        file.seek(0)
+        file.name = f'image.{self.formats[image_format]}'
+        return file
@@ -1,44 +1,55 @@
 from django.contrib.auth import get_user_model
 
 from django_filters import rest_framework as filters
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.catalogue import get_or_build
+from recipes.models import Recipe, Tag
 
 User = get_user_model()
 
 
+def get_tag_ids():
+    """Соответствие slug → id тегов из кэша справочника тегов."""
+    return get_or_build(
+        'tags', lambda: dict(Tag.objects.values_list('slug', 'id')),
+        part='ids'
+    )
+
+
+def tag_choices():
+    return [(slug, slug) for slug in get_tag_ids()]
+
+
 class RecipeFilter(filters.FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(
-        queryset=Tag.objects.all(),
-        field_name='tags__slug'
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices,
+        method='get_tags'
     )
     is_favorited = filters.BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='get_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='get_search')
+    ordering = filters.OrderingFilter(
+        fields=('favorites_count', 'pub_date')
+    )
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
 
+    def get_tags(self, queryset, name, value):
+        tag_ids = get_tag_ids()
+        return queryset.with_tags([tag_ids[slug] for slug in value])
+
+    def get_search(self, queryset, name, value):
+        return queryset.search(value)
+
     def get_is_favorited(self, queryset, name, value):
         if value:
-            return Recipe.objects.filter(
-                favorite_recipe__user=self.request.user
-            )
-        return Recipe.objects.all()
+            return queryset.favorited_by(self.request.user)
+        return queryset
 
     def get_is_in_shopping_cart(self, queryset, name, value):
         if value:
-            return Recipe.objects.filter(shopping_cart__user=self.request.user)
-        return Recipe.objects.all()
-
-
-class IngredientFilter(filters.FilterSet):
-    name = filters.CharFilter(
-        field_name='name',
-        lookup_expr='istartswith'
-    )
-
-    class Meta:
-        model = Ingredient
-        fields = ('name',)
+            return queryset.in_shopping_cart_of(self.request.user)
+        return queryset
@@ -0,0 +1,262 @@
+import json
+import statistics
+import subprocess
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries
+from django.db.models import Count
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import timezone
+
+from api.renderers import FastJSONRenderer
+from api.serializers import RecipeListSerializer
+from recipes.models import Ingredient, Recipe, ShoppingListItem, Tag
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = ('Измеряет задержки (p50/p95/p99), число SQL-запросов и '
+            'выделения памяти основных эндпоинтов API на текущей базе.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='Сколько раз вызывать каждый эндпоинт.')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='Сколько первых вызовов не учитывать.')
+        parser.add_argument('--output',
+                            help='Куда сохранить результаты в JSON.')
+        parser.add_argument('--compare',
+                            help='JSON предыдущего запуска для сравнения.')
+        parser.add_argument('--only', nargs='+', default=(),
+                            help='Измерять только эндпоинты с этими именами.')
+
+    def get_endpoints(self):
+        recipe = Recipe.objects.order_by('-favorites_count').first()
+        tags = list(Tag.objects.values_list('slug', flat=True)[:10])
+        ingredients = list(Ingredient.objects.filter(
+            ingredient_recipe__isnull=False
+        ).values_list('pk', flat=True).distinct()[:5])
+        ingredient = Ingredient.objects.order_by('name').first()
+        endpoints = {
+            'recipes-list-anonymous': (False, '/api/recipes/'),
+            'recipes-list': (True, '/api/recipes/'),
+            'recipes-list-cursor': (True, '/api/recipes/?cursor='),
+            'recipes-list-favorited': (True, '/api/recipes/?is_favorited=1'),
+            'users-list': (True, '/api/users/'),
+            'subscriptions': (True, '/api/users/subscriptions/'),
+            'download-shopping-cart': (
+                True, '/api/recipes/download_shopping_cart/'
+            ),
+            'tags-list': (False, '/api/tags/'),
+            'ingredients-list': (False, '/api/ingredients/'),
+        }
+        for count in (1, 3, 10):
+            if len(tags) >= count:
+                endpoints[f'recipes-list-tags-{count}'] = (
+                    True, '/api/recipes/?' + '&'.join(
+                        f'tags={tag}' for tag in tags[:count]
+                    )
+                )
+        if recipe is not None:
+            endpoints['recipes-detail'] = (
+                True, f'/api/recipes/{recipe.pk}/'
+            )
+            endpoints['recipes-search'] = (
+                True, f'/api/recipes/?search={recipe.name.split()[0]}'
+            )
+        if ingredients:
+            endpoints['what-to-cook'] = (
+                True, '/api/recipes/what_to_cook/?ingredients='
+                + ','.join(map(str, ingredients))
+            )
+        if ingredient is not None:
+            endpoints['ingredients-autocomplete'] = (
+                False, f'/api/ingredients/?name={ingredient.name[:3]}'
+            )
+        return endpoints
+
+    def get_user(self):
+        """Пользователь с наибольшим числом подписок."""
+        user = User.objects.annotate(
+            subscriptions=Count('follower', distinct=True)
+        ).order_by('-subscriptions', '-pk').first()
+        if user is None:
+            raise CommandError(
+                'В базе нет пользователей, сначала запустите generate_data.'
+            )
+        return user
+
+    def fetch(self, client, url):
+        """Запрос вместе с чтением потокового ответа до конца."""
+        response = client.get(url)
+        if response.status_code >= 400:
+            raise CommandError(f'{url}: ответ {response.status_code}')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def measure(self, client, url, iterations, warmup):
+        timings = []
+        for number in range(warmup + iterations):
+            start = time.perf_counter()
+            self.fetch(client, url)
+            elapsed = time.perf_counter() - start
+            if number >= warmup:
+                timings.append(elapsed * 1000)
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            self.fetch(client, url)
+        query_count = len(queries.captured_queries)
+        tracemalloc.start()
+        self.fetch(client, url)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        percentiles = statistics.quantiles(timings, n=100)
+        return {
+            'p50_ms': round(percentiles[49], 2),
+            'p95_ms': round(percentiles[94], 2),
+            'p99_ms': round(percentiles[98], 2),
+            'mean_ms': round(statistics.mean(timings), 2),
+            'queries': query_count,
+            'peak_allocated_kb': round(peak / 1024, 1),
+        }
+
+    def measure_serialization(self, user, iterations, size=100):
+        """Медианное время сериализации и рендеринга страницы ленты из
+        size рецептов, уже загруженных из базы."""
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        recipes = list(Recipe.objects.for_feed(user)[:size])
+        serialize, render = [], []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            data = RecipeListSerializer(
+                recipes, many=True, context={'request': request}
+            ).data
+            serialize.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            FastJSONRenderer().render(data)
+            render.append(time.perf_counter() - start)
+        return {
+            'recipes': len(recipes),
+            'serialize_ms': round(statistics.median(serialize) * 1000, 2),
+            'render_ms': round(statistics.median(render) * 1000, 2),
+        }
+
+    def measure_connection(self, repeats=20):
+        """Медианное время открытия нового соединения с базой и проверки
+        уже открытого — цена CONN_MAX_AGE = 0 против постоянных
+        соединений с проверкой перед запросом."""
+        connect, check = [], []
+        for _ in range(repeats):
+            connection.close()
+            start = time.perf_counter()
+            connection.ensure_connection()
+            connect.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            connection.is_usable()
+            check.append(time.perf_counter() - start)
+        return {
+            'connect_ms': round(statistics.median(connect) * 1000, 3),
+            'health_check_ms': round(statistics.median(check) * 1000, 3),
+        }
+
+    def get_commit(self):
+        try:
+            return subprocess.run(
+                ('git', 'rev-parse', '--short', 'HEAD'),
+                capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def compare(self, results, serialization, path):
+        with open(path, encoding='utf-8') as file:
+            report = json.load(file)
+        previous = report['endpoints']
+        before = report.get('serialization')
+        if before:
+            self.stdout.write(
+                f'Сериализация ленты: {before["serialize_ms"]} → '
+                f'{serialization["serialize_ms"]} мс, рендеринг '
+                f'{before["render_ms"]} → {serialization["render_ms"]} мс'
+            )
+        for name, current in results.items():
+            if name not in previous:
+                continue
+            before, after = previous[name]['p95_ms'], current['p95_ms']
+            change = (after - before) / before * 100 if before else 0
+            self.stdout.write(
+                f'{name}: p95 {before} → {after} мс ({change:+.0f}%), '
+                f'запросов {previous[name]["queries"]} → '
+                f'{current["queries"]}'
+            )
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 2:
+            raise CommandError('--iterations должно быть не меньше 2.')
+        user = self.get_user()
+        anonymous = APIClient()
+        authenticated = APIClient()
+        authenticated.force_authenticate(user)
+        endpoints = self.get_endpoints()
+        unknown = set(options['only']) - endpoints.keys()
+        if unknown:
+            raise CommandError(f'Неизвестные эндпоинты: {sorted(unknown)}')
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver'], DEBUG=False):
+            for name, (auth, url) in endpoints.items():
+                if options['only'] and name not in options['only']:
+                    continue
+                client = authenticated if auth else anonymous
+                results[name] = self.measure(
+                    client, url, options['iterations'], options['warmup']
+                )
+                self.stdout.write(
+                    f'{name}: p50 {results[name]["p50_ms"]} мс, '
+                    f'p95 {results[name]["p95_ms"]} мс, '
+                    f'p99 {results[name]["p99_ms"]} мс, '
+                    f'запросов {results[name]["queries"]}'
+                )
+            serialization = self.measure_serialization(
+                user, options['iterations']
+            )
+            self.stdout.write(
+                f'Лента из {serialization["recipes"]} рецептов: '
+                f'сериализация {serialization["serialize_ms"]} мс, '
+                f'рендеринг {serialization["render_ms"]} мс'
+            )
+        connection_costs = self.measure_connection()
+        self.stdout.write(
+            f'Новое соединение: {connection_costs["connect_ms"]} мс, '
+            f'проверка открытого: {connection_costs["health_check_ms"]} мс'
+        )
+        report = {
+            'commit': self.get_commit(),
+            'created': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'dataset': {
+                'users': User.objects.count(),
+                'recipes': Recipe.objects.count(),
+                'ingredients': Ingredient.objects.count(),
+                'shopping_list_items': ShoppingListItem.objects.filter(
+                    user=user
+                ).count(),
+            },
+            'serialization': serialization,
+            'connection': connection_costs,
+            'endpoints': results,
+        }
+        if options['compare']:
+            self.compare(results, serialization, options['compare'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Результаты сохранены в {options["output"]}'
+            ))
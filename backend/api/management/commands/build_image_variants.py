@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from recipes.images import process
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Строит уменьшенные копии картинок рецептов, '
+            'у которых их ещё нет.')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.filter(has_image_variants=False).exclude(
+            image=''
+        ).values_list('pk', 'image')
+        total = 0
+        for recipe_id, name in recipes.iterator():
+            process(recipe_id, name)
+            total += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {total}'
+        ))
@@ -0,0 +1,59 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from recipes.images import variant_names
+from recipes.models import Recipe
+from recipes.storage import image_storage
+
+
+class Command(BaseCommand):
+    help = ('Удаляет картинки рецептов и их уменьшенные копии, '
+            'на которые не ссылается ни один рецепт.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age',
+            type=int,
+            default=60,
+            help='Не трогать файлы моложе стольких минут.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только посчитать лишние файлы, ничего не удаляя.'
+        )
+
+    def walk(self, directory):
+        directories, files = image_storage.listdir(directory)
+        for name in files:
+            yield posixpath.join(directory, name)
+        for subdirectory in directories:
+            yield from self.walk(posixpath.join(directory, subdirectory))
+
+    def handle(self, *args, **options):
+        root = Recipe._meta.get_field('image').upload_to.rstrip('/')
+        if not image_storage.exists(root):
+            return
+        used = set()
+        names = Recipe.objects.exclude(image='').values_list(
+            'image', flat=True
+        )
+        for name in names.iterator():
+            used.add(name)
+            used.update(variant_names(name).values())
+        threshold = timezone.now() - timedelta(minutes=options['min_age'])
+        removed = 0
+        for name in self.walk(root):
+            if (name in used
+                    or image_storage.get_modified_time(name) > threshold):
+                continue
+            removed += 1
+            if not options['dry_run']:
+                image_storage.delete(name)
+        if options['dry_run']:
+            self.stdout.write(f'Лишних файлов: {removed}')
+            return
+        self.stdout.write(self.style.SUCCESS(f'Удалено файлов: {removed}'))
@@ -0,0 +1,199 @@
+import random
+import uuid
+from io import BytesIO
+from itertools import islice
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Max
+
+from PIL import Image
+from recipes.catalogue import bump_version
+from recipes.images import build_variants
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag)
+from recipes.storage import image_storage
+from users.models import Subscribe, User
+
+WORDS = ('суп', 'салат', 'пирог', 'каша', 'рагу', 'запеканка', 'омлет',
+         'паста', 'плов', 'борщ', 'котлеты', 'блины', 'соус', 'десерт')
+
+
+def batches(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими пользователями, рецептами, '
+            'избранным, подписками и корзинами для нагрузочных тестов.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help='Сколько пользователей создать.')
+        parser.add_argument('--recipes', type=int, default=10000,
+                            help='Сколько рецептов создать.')
+        parser.add_argument('--tags', type=int, default=10,
+                            help='Сколько тегов должно быть в базе.')
+        parser.add_argument('--ingredients', type=int, default=2000,
+                            help='Сколько ингредиентов должно быть в базе.')
+        parser.add_argument('--min-ingredients', type=int, default=3,
+                            help='Наименьшее число ингредиентов в рецепте.')
+        parser.add_argument('--max-ingredients', type=int, default=12,
+                            help='Наибольшее число ингредиентов в рецепте.')
+        parser.add_argument('--favorites', type=int, default=20,
+                            help='Рецептов в избранном у пользователя.')
+        parser.add_argument('--cart', type=int, default=5,
+                            help='Рецептов в корзине у пользователя.')
+        parser.add_argument('--subscriptions', type=int, default=10,
+                            help='Подписок у пользователя.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Зерно генератора случайных чисел.')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Сколько строк записывать за один запрос.')
+
+    def insert(self, model, objects):
+        """Вставляет объекты пачками и возвращает их id по порядку.
+
+        id берутся из базы, потому что на SQLite bulk_create их не
+        возвращает; во время генерации в таблицы никто не должен писать.
+        """
+        ids = []
+        for batch in batches(objects, self.batch_size):
+            last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+            model.objects.bulk_create(batch)
+            ids.extend(model.objects.filter(pk__gt=last).order_by(
+                'pk'
+            ).values_list('pk', flat=True))
+        return ids
+
+    def link(self, model, objects):
+        for batch in batches(objects, self.batch_size):
+            model.objects.bulk_create(batch)
+
+    def create_tags(self, count, run):
+        existing = list(Tag.objects.values_list('pk', flat=True))
+        colors = set(Tag.objects.values_list('color', flat=True))
+        tags = []
+        for number in range(count - len(existing)):
+            color = f'#{self.random.randrange(0x1000000):06x}'
+            while color in colors:
+                color = f'#{self.random.randrange(0x1000000):06x}'
+            colors.add(color)
+            tags.append(Tag(name=f'Тег {run} {number}', color=color,
+                            slug=f'tag-{run}-{number}'))
+        return existing + self.insert(Tag, tags)
+
+    def create_ingredients(self, count, run):
+        existing = list(Ingredient.objects.values_list('pk', flat=True))
+        units = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.')
+        return existing + self.insert(Ingredient, (
+            Ingredient(name=f'Ингредиент {run} {number}',
+                       measurement_unit=self.random.choice(units))
+            for number in range(count - len(existing))
+        ))
+
+    def create_users(self, count, run):
+        password = make_password('synthetic-password')
+        return self.insert(User, (
+            User(username=f'user_{run}_{number}',
+                 email=f'user_{run}_{number}@example.com',
+                 first_name='Имя', last_name='Фамилия', password=password)
+            for number in range(count)
+        ))
+
+    def create_recipes(self, count, user_ids, image):
+        return self.insert(Recipe, (
+            Recipe(
+                author_id=self.random.choice(user_ids),
+                name=f'{self.random.choice(WORDS).capitalize()} '
+                     f'№{number}',
+                text=' '.join(self.random.choices(WORDS, k=30)),
+                image=image,
+                has_image_variants=True,
+                cooking_time=self.random.randint(5, 180)
+            )
+            for number in range(count)
+        ))
+
+    def sample(self, population, count, exclude=None):
+        count = min(count, len(population) - (exclude is not None))
+        chosen = set()
+        while len(chosen) < count:
+            value = self.random.choice(population)
+            if value != exclude:
+                chosen.add(value)
+        return chosen
+
+    def handle(self, *args, **options):
+        if options['min_ingredients'] > options['max_ingredients']:
+            raise CommandError(
+                '--min-ingredients не может быть больше --max-ingredients.'
+            )
+        if options['users'] < 1 or options['batch_size'] < 1:
+            raise CommandError(
+                '--users и --batch-size должны быть положительными.'
+            )
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        run = uuid.uuid4().hex[:6]
+        buffer = BytesIO()
+        Image.new('RGB', (64, 64), 'orange').save(buffer, 'PNG')
+        image = image_storage.save(
+            'recipes/images/synthetic.png', ContentFile(buffer.getvalue())
+        )
+        build_variants(image)
+        tag_ids = self.create_tags(options['tags'], run)
+        ingredient_ids = self.create_ingredients(options['ingredients'], run)
+        user_ids = self.create_users(options['users'], run)
+        self.stdout.write(f'Пользователей: {len(user_ids)}')
+        recipe_ids = self.create_recipes(options['recipes'], user_ids, image)
+        self.stdout.write(f'Рецептов: {len(recipe_ids)}')
+        self.link(IngredientRecipe, (
+            IngredientRecipe(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                             amount=self.random.randint(1, 500))
+            for recipe_id in recipe_ids
+            for ingredient_id in self.sample(
+                ingredient_ids, self.random.randint(
+                    options['min_ingredients'], options['max_ingredients']
+                )
+            )
+        ))
+        if tag_ids:
+            self.link(Recipe.tags.through, (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in self.sample(tag_ids, self.random.randint(1, 3))
+            ))
+        if recipe_ids:
+            for model, per_user in ((Favorite, options['favorites']),
+                                    (ShoppingCart, options['cart'])):
+                self.link(model, (
+                    model(user_id=user_id, recipe_id=recipe_id)
+                    for user_id in user_ids
+                    for recipe_id in self.sample(recipe_ids, per_user)
+                ))
+        self.link(Subscribe, (
+            Subscribe(user_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in self.sample(
+                user_ids, options['subscriptions'], exclude=user_id
+            )
+        ))
+        if recipe_ids:
+            Recipe.objects.filter(
+                pk__gte=recipe_ids[0]
+            ).update_search_vector()
+        call_command('recount', stdout=self.stdout)
+        call_command('rebuild_shopping_lists', stdout=self.stdout)
+        for name in ('tags', 'ingredients', 'users', 'ingredient_index'):
+            bump_version(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Синтетические данные созданы, метка запуска {run}.'
+        ))
@@ -0,0 +1,119 @@
+import json
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.request import Request, urlopen
+
+from django.core.management.base import BaseCommand, CommandError
+
+PATHS = ('/api/recipes/', '/api/tags/', '/api/ingredients/')
+
+
+class Command(BaseCommand):
+    help = ('Нагружает запущенный сервер параллельными запросами к '
+            'эндпоинтам чтения и измеряет пропускную способность и '
+            'задержки, чтобы сравнивать варианты развёртывания.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000',
+                            help='Адрес сервера.')
+        parser.add_argument('--paths', nargs='+', default=PATHS,
+                            help='Пути, которые запрашивать по кругу.')
+        parser.add_argument('--concurrency', type=int, default=500,
+                            help='Сколько клиентов работает одновременно.')
+        parser.add_argument('--requests', type=int, default=5000,
+                            help='Сколько запросов сделать всего.')
+        parser.add_argument('--timeout', type=float, default=30,
+                            help='Таймаут одного запроса в секундах.')
+        parser.add_argument('--token',
+                            help='Токен пользователя для авторизации.')
+        parser.add_argument('--output',
+                            help='Куда сохранить результаты в JSON.')
+
+    def request(self, url):
+        request = Request(url, headers=self.headers)
+        start = time.perf_counter()
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                response.read()
+                status = response.status
+        except HTTPError as error:
+            status = error.code
+        except (URLError, OSError):
+            status = None
+        return status, time.perf_counter() - start
+
+    def detail_path(self, base):
+        """Путь к первому рецепту ленты, чтобы нагружать и детальную
+        страницу рецепта."""
+        request = Request(f'{base}/api/recipes/?limit=1',
+                          headers=self.headers)
+        try:
+            with urlopen(request, timeout=self.timeout) as response:
+                results = json.load(response)['results']
+        except (URLError, OSError, ValueError, KeyError) as error:
+            raise CommandError(f'Сервер {base} недоступен: {error}')
+        return f'/api/recipes/{results[0]["id"]}/' if results else None
+
+    def handle(self, *args, **options):
+        if options['concurrency'] < 1 or options['requests'] < 2:
+            raise CommandError(
+                '--concurrency должно быть положительным, '
+                '--requests — не меньше 2.'
+            )
+        base = options['url'].rstrip('/')
+        self.timeout = options['timeout']
+        self.headers = {'Accept': 'application/json'}
+        if options['token']:
+            self.headers['Authorization'] = f'Token {options["token"]}'
+        paths = list(options['paths'])
+        detail = self.detail_path(base)
+        if detail is not None and detail not in paths:
+            paths.append(detail)
+        results = {path: [] for path in paths}
+        errors = {path: 0 for path in paths}
+        lock = threading.Lock()
+
+        def worker(number):
+            path = paths[number % len(paths)]
+            status, elapsed = self.request(base + path)
+            with lock:
+                if status is None or status >= 400:
+                    errors[path] += 1
+                else:
+                    results[path].append(elapsed * 1000)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            list(executor.map(worker, range(options['requests'])))
+        duration = time.perf_counter() - start
+        report = {
+            'url': base,
+            'concurrency': options['concurrency'],
+            'requests': options['requests'],
+            'duration_s': round(duration, 2),
+            'requests_per_second': round(options['requests'] / duration, 1),
+            'paths': {},
+        }
+        for path, timings in results.items():
+            stats = {'errors': errors[path]}
+            if len(timings) > 1:
+                percentiles = statistics.quantiles(timings, n=100)
+                stats.update(p50_ms=round(percentiles[49], 2),
+                             p95_ms=round(percentiles[94], 2),
+                             p99_ms=round(percentiles[98], 2))
+            report['paths'][path] = stats
+            self.stdout.write(f'{path}: ' + ', '.join(
+                f'{key} {value}' for key, value in stats.items()
+            ))
+        self.stdout.write(
+            f'Запросов в секунду: {report["requests_per_second"]}'
+        )
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(self.style.SUCCESS(
+                f'Результаты сохранены в {options["output"]}'
+            ))
@@ -1,22 +1,135 @@
 import csv
+import json
+import os
+import time
+from io import StringIO
+from itertools import islice
 
-from django.core.management.base import BaseCommand
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
 
+from recipes.catalogue import bump_version
 from recipes.models import Ingredient
 
 
 class Command(BaseCommand):
-    help = 'Добавляет ингредиенты из сsv файла в базу данных sqlite3.'
+    help = ('Загружает ингредиенты из csv или json файла в базу данных. '
+            'Уже существующие ингредиенты пропускаются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default=os.path.join(settings.BASE_DIR, 'data', 'ingredients.csv'),
+            help='Путь к файлу, по умолчанию data/ingredients.csv.'
+        )
+        parser.add_argument(
+            '--format',
+            choices=('csv', 'json'),
+            help='Формат файла, по умолчанию определяется по расширению.'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Сколько строк записывать за один запрос.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только прочитать и проверить файл, ничего не записывая.'
+        )
+
+    def read_csv(self, file):
+        for line, row in enumerate(csv.reader(file, delimiter=','), start=1):
+            if len(row) != 2:
+                raise CommandError(f'Строка {line}: ожидалось 2 поля.')
+            yield row
+
+    def read_json(self, file):
+        for number, item in enumerate(json.load(file), start=1):
+            try:
+                yield item['name'], item['measurement_unit']
+            except (KeyError, TypeError):
+                raise CommandError(
+                    f'Запись {number}: нужны name и measurement_unit.'
+                )
+
+    def read_chunks(self, rows, size):
+        rows = ((name.strip(), unit.strip()) for name, unit in rows)
+        while True:
+            chunk = list(islice(rows, size))
+            if not chunk:
+                return
+            yield chunk
+
+    def bulk_create(self, chunks):
+        for chunk in chunks:
+            Ingredient.objects.bulk_create(
+                (Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in chunk),
+                ignore_conflicts=True
+            )
+            yield len(chunk)
+
+    def copy(self, chunks):
+        """Загрузка через COPY во временную таблицу, только PostgreSQL."""
+        table = Ingredient._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_staging '
+                '(name varchar(200), measurement_unit varchar(200)) '
+                'ON COMMIT DROP'
+            )
+            for chunk in chunks:
+                buffer = StringIO()
+                csv.writer(buffer).writerows(chunk)
+                buffer.seek(0)
+                cursor.copy_expert(
+                    'COPY ingredient_staging FROM STDIN WITH CSV', buffer
+                )
+                yield len(chunk)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                'FROM ingredient_staging ON CONFLICT DO NOTHING'
+            )
 
     def handle(self, *args, **options):
-        with open(
-            'data/ingredients.csv',
-            'r', encoding='utf-8'
-        ) as file:
-            reader = csv.reader(file, delimiter=',')
-            Ingredient.objects.all().delete
-            for row in reader:
-                name, unit = row
-                Ingredient.objects.get_or_create(
-                    name=name, measurement_unit=unit)
-        print('Загрузка завершена')
+        path = options['path']
+        file_format = options['format'] or os.path.splitext(path)[1][1:]
+        if file_format not in ('csv', 'json'):
+            raise CommandError('Поддерживаются только csv и json файлы.')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size должен быть положительным.')
+        before = Ingredient.objects.count()
+        start = time.monotonic()
+        total = 0
+        with open(path, 'r', encoding='utf-8') as file, transaction.atomic():
+            rows = getattr(self, f'read_{file_format}')(file)
+            chunks = self.read_chunks(rows, options['chunk_size'])
+            if options['dry_run']:
+                loaded = (len(chunk) for chunk in chunks)
+            elif connection.vendor == 'postgresql':
+                loaded = self.copy(chunks)
+            else:
+                loaded = self.bulk_create(chunks)
+            for count in loaded:
+                total += count
+                if options['verbosity'] > 1:
+                    self.stdout.write(f'Обработано строк: {total}')
+        elapsed = time.monotonic() - start
+        rate = total / elapsed if elapsed else total
+        self.stdout.write(
+            f'Прочитано строк: {total} за {elapsed:.2f} с '
+            f'({rate:.0f} строк/с)'
+        )
+        if options['dry_run']:
+            self.stdout.write('Пробный запуск, база данных не изменена.')
+            return
+        bump_version('ingredients')
+        self.stdout.write(self.style.SUCCESS(
+            'Загрузка завершена, новых ингредиентов: '
+            f'{Ingredient.objects.count() - before}'
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import ShoppingListItem
+
+
+class Command(BaseCommand):
+    help = ('Сверяет сводные списки покупок с корзинами '
+            'и пересобирает их с нуля.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сообщить о расхождениях, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        expected = set(ShoppingListItem.objects.expected().iterator())
+        actual = set(ShoppingListItem.objects.values_list(
+            'user_id', 'ingredient_id', 'total_amount'
+        ).iterator())
+        users = {row[0] for row in expected ^ actual}
+        self.stdout.write(f'Расхождения у пользователей: {len(users)}')
+        if options['check']:
+            return
+        count = ShoppingListItem.objects.rebuild()
+        self.stdout.write(self.style.SUCCESS(
+            f'Списки покупок пересобраны, строк: {count}'
+        ))
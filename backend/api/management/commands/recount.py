@@ -0,0 +1,49 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe
+from users.models import Subscribe, User
+
+
+def count_of(model, field):
+    """Подзапрос: число записей model, у которых field указывает на
+    текущую строку внешнего запроса."""
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by().values(
+            field
+        ).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscribe, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = ('Сверяет счётчики избранного, рецептов и подписчиков '
+            'с данными и исправляет расхождения.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сообщить о расхождениях, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        for model, counter, source, field in COUNTERS:
+            actual = count_of(source, field)
+            drifted = model.objects.annotate(actual=actual).exclude(
+                **{counter: F('actual')}
+            ).count()
+            self.stdout.write(
+                f'{model.__name__}.{counter}: расхождений {drifted}'
+            )
+            if drifted and not options['check']:
+                model.objects.update(**{counter: actual})
+        if not options['check']:
+            self.stdout.write(self.style.SUCCESS('Счётчики пересчитаны.'))
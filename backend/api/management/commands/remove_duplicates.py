@@ -0,0 +1,96 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from recipes.models import Favorite, Ingredient, IngredientRecipe, ShoppingCart
+
+# Наибольшее значение PositiveSmallIntegerField в PostgreSQL.
+MAX_AMOUNT = 32767
+
+
+def columns(model, *fields):
+    return ', '.join(model._meta.get_field(name).column for name in fields)
+
+
+def duplicates(model, *fields):
+    """Подзапрос id записей, повторяющих fields записи с меньшим id."""
+    table = model._meta.db_table
+    return (f'SELECT id FROM {table} WHERE id NOT IN (SELECT MIN(id) '
+            f'FROM {table} GROUP BY {columns(model, *fields)})')
+
+
+def merge_ingredients():
+    """Переводит строки рецептов с ингредиентов-дублей на первый
+    ингредиент с тем же названием и единицей измерения."""
+    rows, ingredients = (IngredientRecipe._meta.db_table,
+                         Ingredient._meta.db_table)
+    return (
+        f'UPDATE {rows} SET ingredient_id = (SELECT MIN(k.id) '
+        f'FROM {ingredients} k JOIN {ingredients} i ON k.name = i.name '
+        f'AND k.measurement_unit = i.measurement_unit '
+        f'WHERE i.id = {rows}.ingredient_id) WHERE ingredient_id IN ('
+        f'{duplicates(Ingredient, "name", "measurement_unit")})'
+    )
+
+
+def sum_amounts():
+    """Складывает количество повторяющихся строк ингредиентов рецепта в
+    первую из них, как сериализатор рецепта складывает повторы."""
+    rows = IngredientRecipe._meta.db_table
+    return (
+        f'UPDATE {rows} SET amount = (SELECT CASE WHEN SUM(d.amount) > '
+        f'{MAX_AMOUNT} THEN {MAX_AMOUNT} ELSE SUM(d.amount) END '
+        f'FROM {rows} d WHERE d.recipe_id = {rows}.recipe_id '
+        f'AND d.ingredient_id = {rows}.ingredient_id) '
+        f'WHERE id IN (SELECT MIN(id) FROM {rows} '
+        f'GROUP BY recipe_id, ingredient_id HAVING COUNT(*) > 1)'
+    )
+
+
+# Модель, поля уникального ограничения и запросы, которые выполняются
+# перед удалением её дублей.
+STEPS = (
+    (Favorite, ('user', 'recipe'), ()),
+    (ShoppingCart, ('user', 'recipe'), ()),
+    (Ingredient, ('name', 'measurement_unit'), (merge_ingredients, )),
+    (IngredientRecipe, ('recipe', 'ingredient'), (sum_amounts, )),
+)
+
+
+class Command(BaseCommand):
+    help = ('Удаляет повторяющиеся записи избранного, корзин, ингредиентов '
+            'и строк ингредиентов рецептов, чтобы migrate смог добавить '
+            'уникальные ограничения. Запускается перед migrate и читает '
+            'только столбцы, которые были и до новых миграций.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Только сообщить о дублях, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), connection.cursor() as cursor:
+            # В новой базе до первого migrate таблиц ещё нет.
+            tables = connection.introspection.table_names(cursor)
+            for model, fields, prepare in STEPS:
+                if model._meta.db_table not in tables:
+                    continue
+                cursor.execute(
+                    f'SELECT COUNT(*) FROM ({duplicates(model, *fields)}) d'
+                )
+                count = cursor.fetchone()[0]
+                self.stdout.write(f'{model.__name__}: дублей {count}')
+                if not count or options['check']:
+                    continue
+                for query in prepare:
+                    cursor.execute(query())
+                cursor.execute(
+                    f'DELETE FROM {model._meta.db_table} '
+                    f'WHERE id IN ({duplicates(model, *fields)})'
+                )
+        if not options['check']:
+            self.stdout.write(self.style.SUCCESS(
+                'Дубли удалены. После migrate пересчитайте счётчики и '
+                'списки покупок командами recount и rebuild_shopping_lists.'
+            ))
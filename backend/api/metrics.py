@@ -0,0 +1,194 @@
+"""Метрики запросов к API.
+
+MetricsMiddleware считает для каждого запроса число и время SQL-запросов,
+время сериализации, размер ответа и общее время. Они отдаются в заголовке
+Server-Timing и копятся в памяти процесса по каждому представлению;
+представление metrics_view отдаёт накопленное в текстовом формате Prometheus.
+
+Вьюсет может объявить query_budgets — наибольшее допустимое число
+SQL-запросов для своих действий. Превышение бюджета пишется в лог, а при
+QUERY_BUDGETS_STRICT вызывает QueryBudgetExceeded, что роняет тесты.
+"""
+import logging
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+_local = threading.local()
+_lock = threading.Lock()
+_registry = {}
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestMetrics:
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_time += time.perf_counter() - start
+
+
+class TimedSerializerMixin:
+    """Учитывает время to_representation в метриках текущего запроса;
+    вложенные сериализаторы с этим миксином не считаются дважды."""
+
+    def to_representation(self, instance):
+        metrics = getattr(_local, 'metrics', None)
+        if metrics is None or metrics.serializer_depth:
+            return super().to_representation(instance)
+        metrics.serializer_depth += 1
+        start = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            metrics.serializer_depth -= 1
+            metrics.serializer_time += time.perf_counter() - start
+
+
+def record(view, method, status, metrics, duration, size):
+    with _lock:
+        stats = _registry.setdefault((view, method), {
+            'statuses': {}, 'count': 0, 'duration': 0.0,
+            'buckets': [0] * len(DURATION_BUCKETS), 'queries': 0,
+            'db_time': 0.0, 'serializer_time': 0.0, 'bytes': 0,
+        })
+        stats['statuses'][status] = stats['statuses'].get(status, 0) + 1
+        stats['count'] += 1
+        stats['duration'] += duration
+        for index, bound in enumerate(DURATION_BUCKETS):
+            if duration <= bound:
+                stats['buckets'][index] += 1
+        stats['queries'] += metrics.queries
+        stats['db_time'] += metrics.db_time
+        stats['serializer_time'] += metrics.serializer_time
+        stats['bytes'] += size
+
+
+def get_query_budget(request):
+    match = request.resolver_match
+    view_class = getattr(match.func, 'cls', None) if match else None
+    budgets = getattr(view_class, 'query_budgets', None)
+    if not budgets:
+        return None
+    action = getattr(match.func, 'actions', {}).get(request.method.lower())
+    return budgets.get(action)
+
+
+class MetricsMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        metrics = _local.metrics = RequestMetrics()
+        start = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(metrics))
+                response = self.get_response(request)
+        finally:
+            _local.metrics = None
+        duration = time.perf_counter() - start
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        size = 0 if response.streaming else len(response.content)
+        record(view, request.method, response.status_code, metrics,
+               duration, size)
+        response['Server-Timing'] = (
+            f'db;dur={metrics.db_time * 1000:.1f};'
+            f'desc="{metrics.queries} queries", '
+            f'serializer;dur={metrics.serializer_time * 1000:.1f}, '
+            f'total;dur={duration * 1000:.1f}'
+        )
+        budget = get_query_budget(request)
+        if budget is not None and metrics.queries > budget:
+            message = (f'{request.method} {view}: {metrics.queries} '
+                       f'SQL-запросов при бюджете {budget}')
+            if settings.QUERY_BUDGETS_STRICT:
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+
+def render_metrics():
+    lines = []
+
+    def metric(name, kind, description, samples):
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        lines.extend(samples)
+
+    with _lock:
+        items = sorted(_registry.items())
+        labels = {
+            key: f'view="{key[0]}",method="{key[1]}"' for key, _ in items
+        }
+        metric('foodgram_requests_total', 'counter', 'Число запросов.', [
+            f'foodgram_requests_total{{{labels[key]},status="{status}"}} '
+            f'{count}'
+            for key, stats in items
+            for status, count in sorted(stats['statuses'].items())
+        ])
+        samples = []
+        for key, stats in items:
+            for bound, count in zip(DURATION_BUCKETS, stats['buckets']):
+                samples.append(
+                    'foodgram_request_duration_seconds_bucket'
+                    f'{{{labels[key]},le="{bound}"}} {count}'
+                )
+            samples.append(
+                'foodgram_request_duration_seconds_bucket'
+                f'{{{labels[key]},le="+Inf"}} {stats["count"]}'
+            )
+            samples.append(
+                'foodgram_request_duration_seconds_sum'
+                f'{{{labels[key]}}} {stats["duration"]}'
+            )
+            samples.append(
+                'foodgram_request_duration_seconds_count'
+                f'{{{labels[key]}}} {stats["count"]}'
+            )
+        metric('foodgram_request_duration_seconds', 'histogram',
+               'Время обработки запроса.', samples)
+        for name, field, description in (
+            ('foodgram_db_queries_total', 'queries', 'Число SQL-запросов.'),
+            ('foodgram_db_duration_seconds_total', 'db_time',
+             'Время SQL-запросов.'),
+            ('foodgram_serializer_duration_seconds_total', 'serializer_time',
+             'Время сериализации ответа.'),
+            ('foodgram_response_bytes_total', 'bytes',
+             'Размер ответов без потоковых.'),
+        ):
+            metric(name, 'counter', description, [
+                f'{name}{{{labels[key]}}} {stats[field]}'
+                for key, stats in items
+            ])
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    """Метрики процесса в текстовом формате Prometheus."""
+    return HttpResponse(
+        render_metrics(), content_type='text/plain; version=0.0.4'
+    )
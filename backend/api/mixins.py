@@ -1,3 +1,8 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
 from rest_framework import mixins, viewsets
 
 
@@ -7,3 +12,48 @@ class RetrieveListViewSet(
     viewsets.GenericViewSet
 ):
     pass
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы для list и retrieve.
+
+    Наследники описывают состояние ответа в get_list_etag и
+    get_object_etag; если If-None-Match совпадает с ним, ответ 304
+    отдаётся до выборки объектов и сериализации.
+    """
+
+    def get_list_etag(self, request):
+        return None
+
+    def get_object_etag(self, request):
+        return None
+
+    def conditional_response(self, request, state, build):
+        if state is None:
+            return build()
+        # Один и тот же URL может отдаваться в разных форматах.
+        state = (state, request.accepted_media_type)
+        etag = quote_etag(hashlib.md5(str(state).encode()).hexdigest())
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            response = build()
+        response['ETag'] = etag
+        return response
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request,
+            self.get_list_etag(request),
+            lambda: super(ConditionalGetMixin, self).list(
+                request, *args, **kwargs
+            )
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(
+            request,
+            self.get_object_etag(request),
+            lambda: super(ConditionalGetMixin, self).retrieve(
+                request, *args, **kwargs
+            )
+        )
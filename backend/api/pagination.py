@@ -0,0 +1,135 @@
+import hashlib
+import json
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+from functools import reduce
+from operator import and_, or_
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(LimitOffsetPagination):
+    """Постраничный вывод по limit/offset или по курсору.
+
+    Без параметра cursor работает как LimitOffsetPagination. С параметром
+    cursor (для первой страницы пустым) страница выбирается условием по
+    полям ordering от последней записи предыдущей страницы, без OFFSET и
+    без COUNT(*). Общее число записей отдаётся только по запросу
+    ?count=true и берётся из кэша на CURSOR_COUNT_CACHE_TIMEOUT секунд.
+    Если у выборки уже есть своя сортировка (?ordering=, поиск по
+    релевантности), курсор вернул бы записи не в том порядке, поэтому
+    такой запрос отклоняется с ошибкой 400.
+    """
+    ordering = ('-id', )
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    known_count = None
+    invalid_cursor_message = 'Неверный курсор.'
+    ordered_cursor_message = (
+        'Курсор нельзя сочетать с сортировкой и поиском по релевантности.'
+    )
+
+    def uses_cursor(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def get_count(self, queryset):
+        """Число записей; представление, уже посчитавшее его (например,
+        для ETag), передаёт его в known_count, чтобы не считать дважды."""
+        if self.known_count is not None:
+            return self.known_count
+        return super().get_count(queryset)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.uses_cursor(request)
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
+        if queryset.query.order_by:
+            raise ValidationError({
+                self.cursor_query_param: [self.ordered_cursor_message]
+            })
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'true':
+            self.count = self.get_cached_count(queryset)
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            queryset = queryset.filter(
+                self.get_position_filter(queryset.model, cursor)
+            )
+        page = list(queryset[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        page = page[:self.limit]
+        self.last = page[-1] if page else None
+        return page
+
+    def get_cached_count(self, queryset):
+        sql = str(queryset.values('pk').query)
+        key = 'pagination:count:' + hashlib.md5(sql.encode()).hexdigest()
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.CURSOR_COUNT_CACHE_TIMEOUT)
+        return count
+
+    def encode_cursor(self, obj):
+        position = [
+            str(getattr(obj, name.lstrip('-'))) for name in self.ordering
+        ]
+        return b64encode(json.dumps(position).encode()).decode()
+
+    def get_position_filter(self, model, cursor):
+        try:
+            position = json.loads(b64decode(cursor.encode()))
+            values = [
+                model._meta.get_field(name.lstrip('-')).to_python(value)
+                for name, value in zip(self.ordering, position)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+        if len(values) != len(self.ordering) or None in values:
+            raise NotFound(self.invalid_cursor_message)
+        conditions = []
+        for index, name in enumerate(self.ordering):
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            equal = [Q(**{field.lstrip('-'): value}) for field, value in
+                     zip(self.ordering[:index], values[:index])]
+            after = Q(**{f'{name.lstrip("-")}__{lookup}': values[index]})
+            conditions.append(reduce(and_, equal, after))
+        return reduce(or_, conditions)
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.last)
+        )
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('count', self.count),
+            ('next', self.get_next_link()),
+            ('previous', None),
+            ('results', data)
+        ]))
+
+
+class RecipePagination(KeysetPagination):
+    ordering = ('-pub_date', '-id')
+
+
+class UserPagination(KeysetPagination):
+    ordering = ('id', )
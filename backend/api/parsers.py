@@ -0,0 +1,31 @@
+from django.conf import settings
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import JSONParser, MultiPartParser
+
+
+class RequestTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Слишком большой запрос.'
+    default_code = 'request_too_large'
+
+
+class SizeLimitMixin:
+    """Отклоняет запрос с Content-Length больше RECIPE_REQUEST_MAX_SIZE,
+    не читая тело."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        meta = parser_context['request'].META
+        length = meta.get('CONTENT_LENGTH') or 0
+        if int(length) > settings.RECIPE_REQUEST_MAX_SIZE:
+            raise RequestTooLarge()
+        return super().parse(stream, media_type, parser_context)
+
+
+class RecipeJSONParser(SizeLimitMixin, JSONParser):
+    pass
+
+
+class RecipeMultiPartParser(SizeLimitMixin, MultiPartParser):
+    pass
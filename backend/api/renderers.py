@@ -0,0 +1,39 @@
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from rest_framework.renderers import JSONRenderer
+
+ORJSON_OPTIONS = (
+    orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+    if orjson else 0
+)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer на orjson.
+
+    Пишет те же байты, что и стандартный рендерер DRF с настройками по
+    умолчанию (UNICODE_JSON и COMPACT_JSON): даты, Decimal и прочие типы
+    отдаются его кодировщику, U+2028 и U+2029 экранируются. Отличаются
+    только числа с плавающей точкой в экспоненциальной записи (1e-5
+    вместо 1e-05) и NaN с бесконечностью, которые orjson пишет как null,
+    а стандартный рендерер не пропускает. Для отступов, ensure_ascii и
+    без orjson работает стандартный рендерер.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type,
+                                   renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        if data is None:
+            return b''
+        content = orjson.dumps(
+            data, default=self.encoder_class().default, option=ORJSON_OPTIONS
+        )
+        return content.replace('\u2028'.encode(), b'\\u2028').replace(
+            '\u2029'.encode(), b'\\u2029'
+        )
@@ -1,14 +1,20 @@
+import json
+
 from django.contrib.auth import get_user_model
-from django.db.models import F
-from django.shortcuts import get_object_or_404
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
 
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from drf_extra_fields.fields import Base64ImageField
-from recipes.models import Favorite, Ingredient, IngredientRecipe, Recipe, Tag
+from recipes.ingredient_index import schedule_change
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag)
 from rest_framework import serializers
 from rest_framework.serializers import ValidationError
 from users.models import Subscribe
 
+from .fields import ImageVariantsField, RecipeImageField
+from .metrics import TimedSerializerMixin
+
 User = get_user_model()
 
 
@@ -19,17 +25,20 @@ class CustomUserCreateSerializer(UserCreateSerializer):
                   'first_name', 'last_name', 'password')
 
 
-class CustomUserSerializer(UserSerializer):
+class CustomUserSerializer(TimedSerializerMixin, UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
     def get_is_subscribed(self, obj):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
-        return Subscribe.objects.filter(
-            user=user,
-            author=obj
-        ).exists()
+        if 'subscribed_ids' not in self.context:
+            self.context['subscribed_ids'] = set(
+                Subscribe.objects.filter(user=user).values_list(
+                    'author_id', flat=True
+                )
+            )
+        return obj.id in self.context['subscribed_ids']
 
     class Meta:
         model = User
@@ -43,32 +52,21 @@ class PasswordSerializer(serializers.Serializer):
 
 
 class SubscriptionsRecipeSerializer(serializers.ModelSerializer):
-    image = Base64ImageField()
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'images', 'cooking_time')
 
 
-class SubscribeSerializer(serializers.ModelSerializer):
-    is_subscribed = serializers.SerializerMethodField()
+class SubscribeSerializer(CustomUserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta:
         model = User
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'is_subscribed', 'recipes', 'recipes_count', )
 
-    def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-        return Subscribe.objects.filter(
-            user=user,
-            author=obj
-        ).exists()
-
     def get_recipes(self, obj):
         limit = self.context['request'].query_params.get('recipes_limit')
         if limit is None:
@@ -77,23 +75,22 @@ class SubscribeSerializer(serializers.ModelSerializer):
             recipes = obj.recipes.all()[:int(limit)]
         return SubscriptionsRecipeSerializer(recipes, many=True).data
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
 
+class FavoriteSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    images = ImageVariantsField()
 
-class FavoriteSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time', )
+        fields = ('id', 'name', 'image', 'images', 'cooking_time', )
 
 
-class TagSerializer(serializers.ModelSerializer):
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Tag
         fields = ('id', 'name', 'color', 'slug', )
 
 
-class IngredientSerializer(serializers.ModelSerializer):
+class IngredientSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ('id', 'name', 'measurement_unit', )
@@ -123,7 +120,48 @@ class IngredientRecipeCreateSerializer(serializers.ModelSerializer):
         ]
 
 
-class RecipeListSerializer(serializers.ModelSerializer):
+class FeedRepresentationMixin:
+    """Собирает рецепт словарями прямо из объектов, загруженных
+    Recipe.objects.for_feed, не обходя поля вложенных сериализаторов.
+    Результат совпадает с тем, что дали бы объявленные поля."""
+
+    def to_representation(self, recipe):
+        fields = self.fields
+        author = recipe.author
+        return {
+            'id': recipe.id,
+            'tags': [
+                {'id': tag.id, 'name': tag.name, 'color': tag.color,
+                 'slug': tag.slug}
+                for tag in recipe.tags.all()
+            ],
+            'author': {
+                'email': author.email,
+                'id': author.id,
+                'username': author.username,
+                'first_name': author.first_name,
+                'last_name': author.last_name,
+                'is_subscribed': fields['author'].get_is_subscribed(author),
+            },
+            'ingredients': [
+                {'id': row.ingredient.id, 'name': row.ingredient.name,
+                 'measurement_unit': row.ingredient.measurement_unit,
+                 'amount': row.amount}
+                for row in recipe.ingredient_recipe.all()
+            ],
+            'is_favorited': self.get_is_favorited(recipe),
+            'is_in_shopping_cart': self.get_is_in_shopping_cart(recipe),
+            'name': recipe.name,
+            'image': (fields['images'].absolute_url(recipe.image.name)
+                      if recipe.image else None),
+            'images': fields['images'].to_representation(recipe),
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+        }
+
+
+class RecipeListSerializer(TimedSerializerMixin, FeedRepresentationMixin,
+                           serializers.ModelSerializer):
     tags = TagSerializer(many=True)
     author = CustomUserSerializer()
     ingredients = IngredientRecipeListSerializer(
@@ -132,17 +170,20 @@ class RecipeListSerializer(serializers.ModelSerializer):
     )
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'tags', 'author', 'ingredients', 'is_favorited',
-                  'is_in_shopping_cart', 'name', 'image', 'text',
+                  'is_in_shopping_cart', 'name', 'image', 'images', 'text',
                   'cooking_time')
 
     def get_is_favorited(self, obj):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return Favorite.objects.filter(
             user=user,
             recipe=obj
@@ -152,6 +193,8 @@ class RecipeListSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         return Recipe.objects.filter(
             shopping_cart__user=user,
             id=obj.id
@@ -166,53 +209,113 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         many=True
     )
     ingredients = IngredientRecipeCreateSerializer(many=True)
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
         fields = ('ingredients', 'tags', 'image',
                   'name', 'text', 'cooking_time', 'author')
 
+    def save(self, **kwargs):
+        try:
+            return super().save(**kwargs)
+        finally:
+            # Временный файл декодированной картинки хранилище уже
+            # перенесло на место, закрываем его до сборки мусора.
+            image = self.validated_data.get('image')
+            if isinstance(image, UploadedFile):
+                image.close()
+
+    def to_internal_value(self, data):
+        if hasattr(data, 'getlist'):
+            data = self.parse_form(data)
+        return super().to_internal_value(data)
+
+    def parse_form(self, data):
+        """Приводит multipart/form-data к виду JSON-запроса: tags
+        передаются повторяющимся полем, ingredients — JSON-строкой."""
+        parsed = data.dict()
+        if 'tags' in data:
+            parsed['tags'] = data.getlist('tags')
+        if 'ingredients' in data:
+            try:
+                parsed['ingredients'] = json.loads(data['ingredients'])
+            except ValueError:
+                raise ValidationError(
+                    {'ingredients': 'Ингредиенты передаются JSON-списком.'}
+                )
+        return parsed
+
     def validate_ingredients(self, data):
-        ingredients = self.initial_data.get('ingredients')
-        if ingredients == []:
+        if not data:
             raise ValidationError('Нужно выбрать минимум 1 ингридиент!')
-        for ingredient in ingredients:
-            if int(ingredient['amount']) <= 0:
+        amounts = {}
+        for ingredient in data:
+            if ingredient['amount'] <= 0:
                 raise ValidationError('Количество должно быть положительным!')
-        return data
+            amounts[ingredient['id']] = (
+                amounts.get(ingredient['id'], 0) + ingredient['amount']
+            )
+        missing = amounts.keys() - Ingredient.objects.in_bulk(amounts).keys()
+        if missing:
+            raise ValidationError(
+                f'Ингредиентов {sorted(missing)} не существует!'
+            )
+        return amounts
 
     def get_ingredients(self, obj):
         ingredients = IngredientRecipe.objects.filter(recipe=obj)
         return IngredientRecipeListSerializer(ingredients).data
 
-    def add_recipe_ingredients(self, ingredients, recipe):
-        for ingredient in ingredients:
-            ingredient_id = ingredient['id']
-            amount = ingredient['amount']
-            if IngredientRecipe.objects.filter(
-                recipe=recipe, ingredient=ingredient_id
-            ).exists():
-                amount += F('amount')
-            IngredientRecipe.objects.update_or_create(
-                recipe=recipe, ingredient=ingredient_id,
-                defaults={'amount': amount})
+    def set_recipe_ingredients(self, recipe, amounts):
+        """Приводит ингредиенты рецепта к amounts ({id: количество}),
+        удаляя, обновляя и добавляя только изменившиеся строки.
+
+        Возвращает изменение количества обновлённых и добавленных
+        ингредиентов: bulk_update и bulk_create не шлют сигналов, а
+        удалённые строки из списков покупок вычитает сигнал post_delete.
+        """
+        existing = {
+            row.ingredient_id: row
+            for row in IngredientRecipe.objects.filter(recipe=recipe)
+        }
+        delta = {
+            key: amounts[key] - row.amount
+            for key, row in existing.items() if key in amounts
+        }
+        changed = []
+        for key, row in existing.items():
+            if key in amounts and row.amount != amounts[key]:
+                row.amount = amounts[key]
+                changed.append(row)
+        IngredientRecipe.objects.filter(
+            recipe=recipe,
+            ingredient_id__in=existing.keys() - amounts.keys()
+        ).delete()
+        IngredientRecipe.objects.bulk_update(changed, ('amount', ))
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient_id=key, amount=value)
+            for key, value in amounts.items() if key not in existing
+        )
+        for key in amounts.keys() - existing.keys():
+            delta[key] = amounts[key]
+        return delta
 
+    @transaction.atomic
     def create(self, validated_data):
-        ingredients = validated_data.pop('ingredients')
+        amounts = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
         recipe.tags.set(tags)
-        for ingredient in ingredients:
-            id = ingredient.get('id')
-            amount = ingredient.get('amount')
-            ingredient_id = get_object_or_404(Ingredient, id=id)
-            IngredientRecipe.objects.create(
-                recipe=recipe, ingredient=ingredient_id, amount=amount
-            )
-        recipe.save()
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient_id=key, amount=value)
+            for key, value in amounts.items()
+        )
+        Recipe.objects.filter(pk=recipe.pk).update_search_vector()
+        schedule_change(recipe.pk, added=set(amounts))
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         instance.image = validated_data.get('image', instance.image)
         instance.name = validated_data.get('name', instance.name)
@@ -220,34 +323,53 @@ class RecipeCreateSerializer(serializers.ModelSerializer):
         instance.cooking_time = validated_data.get(
             'cooking_time', instance.cooking_time
         )
-        tags_data = validated_data.pop('tags')
-        ingredients_data = validated_data.pop('ingredients')
-        instance.tags.clear()
-        instance.ingredients.clear()
-        for tag in tags_data:
-            tag_id = tag.id
-            tag_object = get_object_or_404(Tag, id=tag_id)
-            instance.tags.add(tag_object)
-        for ingredient in ingredients_data:
-            ingredient_id = ingredient.get('id')
-            amount = ingredient.get('amount')
-            ingredient_object = get_object_or_404(Ingredient, id=ingredient_id)
-            instance.ingredients.add(
-                ingredient_object,
-                through_defaults={'amount': amount}
-            )
         instance.save()
+        if 'tags' in validated_data:
+            instance.tags.set(validated_data['tags'])
+        if 'ingredients' in validated_data:
+            delta = self.set_recipe_ingredients(
+                instance, validated_data['ingredients']
+            )
+            ShoppingListItem.objects.change(
+                ShoppingCart.objects.filter(recipe=instance).values_list(
+                    'user_id', flat=True
+                ),
+                delta
+            )
+            schedule_change(
+                instance.pk, added=set(validated_data['ingredients'])
+            )
+        Recipe.objects.filter(pk=instance.pk).update_search_vector()
         return instance
 
     def to_representation(self, instance):
         serializer = RecipeListSerializer(
-            instance,
+            Recipe.objects.for_feed(self.context['request'].user).get(
+                pk=instance.pk
+            ),
             context=self.context
         )
         return serializer.data
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class RecipeMatchSerializer(RecipeListSerializer):
+    coverage = serializers.FloatField(read_only=True)
+
+    class Meta(RecipeListSerializer.Meta):
+        fields = RecipeListSerializer.Meta.fields + ('coverage', )
+
+    def to_representation(self, recipe):
+        data = super().to_representation(recipe)
+        data['coverage'] = self.fields['coverage'].to_representation(
+            recipe.coverage
+        )
+        return data
+
+
+class ShoppingCartSerializer(TimedSerializerMixin,
+                             serializers.ModelSerializer):
+    images = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time', )
+        fields = ('id', 'name', 'image', 'images', 'cooking_time', )
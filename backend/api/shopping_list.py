@@ -0,0 +1,125 @@
+"""Выгрузка списка покупок в разных форматах."""
+import csv
+import os
+import tempfile
+
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
+
+
+class Echo:
+    """Буфер для csv.writer, который отдаёт строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+class ShoppingListRenderer:
+    """Базовый класс для форматов списка покупок.
+
+    Метод render получает итератор строк (название, единица измерения,
+    количество), отсортированных по названию, и по частям отдаёт байты,
+    а get_response отдаёт их потоком. Форматы, которые пишут документ
+    целиком, переопределяют get_response.
+    """
+    content_type = None
+    extension = None
+
+    def get_filename(self):
+        return f'Shoppingcart.{self.extension}'
+
+    def render(self, items):
+        raise NotImplementedError
+
+    def get_response(self, items):
+        return StreamingHttpResponse(
+            self.render(items), content_type=self.content_type
+        )
+
+
+class CsvRenderer(ShoppingListRenderer):
+    content_type = 'text/csv'
+    extension = 'csv'
+
+    def render(self, items):
+        writer = csv.writer(Echo())
+        yield u'\ufeff'.encode('utf8')
+        for item in items:
+            yield writer.writerow(item).encode('utf8')
+
+
+class TextRenderer(ShoppingListRenderer):
+    """Список, сгруппированный по первой букве названия."""
+    content_type = 'text/plain; charset=utf-8'
+    extension = 'txt'
+
+    def render(self, items):
+        letter = None
+        for name, unit, amount in items:
+            if name[:1].upper() != letter:
+                letter = name[:1].upper()
+                yield f'\n{letter}\n'.encode('utf8')
+            yield f'  {name} ({unit}) — {amount}\n'.encode('utf8')
+
+
+class PdfRenderer(ShoppingListRenderer):
+    """Постраничный PDF.
+
+    reportlab пишет документ целиком при сохранении, поэтому он
+    собирается во временном файле, который остаётся в памяти до
+    max_memory_size байт, и отдаётся из него по частям.
+    """
+    content_type = 'application/pdf'
+    extension = 'pdf'
+    font_name = 'ShoppingListFont'
+    max_memory_size = 1024 * 1024
+    margin = 50
+    line_height = 20
+
+    def get_font(self):
+        path = settings.SHOPPING_LIST_PDF_FONT
+        if not os.path.exists(path):
+            return 'Helvetica'
+        if self.font_name not in pdfmetrics.getRegisteredFontNames():
+            pdfmetrics.registerFont(TTFont(self.font_name, path))
+        return self.font_name
+
+    def write(self, items, file):
+        font = self.get_font()
+        page = canvas.Canvas(file, pagesize=A4)
+        width, height = A4
+        page.setFont(font, 14)
+        page.drawString(self.margin, height - self.margin, 'Список покупок')
+        y = height - self.margin - 2 * self.line_height
+        for number, (name, unit, amount) in enumerate(items, start=1):
+            if y < self.margin:
+                page.showPage()
+                y = height - self.margin
+            page.setFont(font, 12)
+            page.drawString(
+                self.margin, y, f'{number}. {name} ({unit}) — {amount}'
+            )
+            y -= self.line_height
+        page.save()
+
+    def get_response(self, items):
+        file = tempfile.SpooledTemporaryFile(max_size=self.max_memory_size)
+        try:
+            self.write(items, file)
+        except Exception:
+            file.close()
+            raise
+        file.seek(0)
+        # FileResponse закрывает файл после отправки.
+        return FileResponse(file, content_type=self.content_type)
+
+
+SHOPPING_LIST_RENDERERS = {
+    renderer.extension: renderer
+    for renderer in (CsvRenderer, TextRenderer, PdfRenderer)
+}
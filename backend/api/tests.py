@@ -0,0 +1,400 @@
+import base64
+import io
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from PIL import Image
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag)
+from rest_framework import serializers
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIRequestFactory, APITestCase
+from users.models import Subscribe, User
+
+from .fields import RecipeImageField
+from .metrics import QueryBudgetExceeded
+from .serializers import RecipeListSerializer
+from .shopping_list import PdfRenderer
+from .views import RecipesViewSet
+
+IMAGE = 'recipes/images/test.png'
+
+# Тесты работают со своим кэшем в памяти, а не с общим файловым кэшем
+# запущенного сервера, а превышение бюджета SQL-запросов в них — ошибка.
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'versions',
+        'TIMEOUT': None,
+    },
+}
+
+
+@override_settings(CACHES=TEST_CACHES, QUERY_BUDGETS_STRICT=True)
+class RecipeFeedTests(APITestCase):
+    """Число SQL-запросов ленты и страницы рецепта не зависит от числа
+    рецептов, тегов и ингредиентов в ответе."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='reader@example.com', username='reader',
+            first_name='Читатель', last_name='Читателев', password='pass'
+        )
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Авторов', password='pass'
+        )
+        cls.tags = [
+            Tag.objects.create(name=f'Тег {number}', slug=f'tag-{number}',
+                               color=f'#00000{number}')
+            for number in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(5)
+        ]
+        for number in range(100):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Текст',
+                image=IMAGE, has_image_variants=True, cooking_time=10
+            )
+            recipe.tags.set(cls.tags[:number % 3 + 1])
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                                 amount=number + 1)
+                for ingredient in ingredients[:number % 5 + 1]
+            )
+            if number % 4 == 0:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+
+    def get_page(self, limit, queries, params=''):
+        with self.assertNumQueries(queries):
+            response = self.client.get(
+                f'/api/recipes/?limit={limit}{params}'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), limit)
+        return response
+
+    def test_feed_queries_do_not_depend_on_page_size(self):
+        # ETag вместе с COUNT, страница, теги, ингредиенты, подписки.
+        self.client.force_authenticate(self.user)
+        for limit in (6, 100):
+            with self.subTest(limit=limit):
+                self.get_page(limit, 5)
+
+    def test_feed_does_not_load_search_vector(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.get_page(6, 4)
+        self.assertFalse(any('search_vector' in query['sql']
+                             for query in queries.captured_queries))
+
+    def test_feed_representation_matches_declared_fields(self):
+        Subscribe.objects.create(user=self.user, author=self.author)
+        recipe = Recipe.objects.filter(favorite_recipe__user=self.user).first()
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        request = APIRequestFactory().get('/api/recipes/')
+        request.user = self.user
+        serializer = RecipeListSerializer(context={'request': request})
+        recipe = Recipe.objects.for_feed(self.user).get(pk=recipe.pk)
+        self.assertEqual(
+            serializer.to_representation(recipe),
+            serializers.ModelSerializer.to_representation(serializer, recipe)
+        )
+
+    def test_anonymous_feed_queries_do_not_depend_on_page_size(self):
+        for limit in (6, 100):
+            with self.subTest(limit=limit):
+                self.get_page(limit, 4)
+
+    def test_cursor_feed_does_not_aggregate(self):
+        # Страница, теги, ингредиенты, подписки: ни COUNT, ни агрегатов
+        # по всей выборке.
+        self.client.force_authenticate(self.user)
+        for limit in (6, 100):
+            with self.subTest(limit=limit):
+                self.get_page(limit, 4, '&cursor=')
+
+    def test_cursor_etag_follows_page(self):
+        self.client.force_authenticate(self.user)
+        url = '/api/recipes/?limit=6&cursor='
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        first = Recipe.objects.order_by('-pub_date', '-id').first()
+        self.client.get(f'/api/recipes/{first.pk}/shopping_cart/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['results'][0]['is_in_shopping_cart'])
+
+    def test_query_budget_is_enforced(self):
+        with mock.patch.dict(RecipesViewSet.query_budgets, list=3):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get('/api/recipes/')
+
+    def test_recipe_detail_queries(self):
+        self.client.force_authenticate(self.user)
+        recipe = Recipe.objects.get(name='Рецепт 14')
+        # ETag, рецепт, теги, ингредиенты, подписки читателя.
+        with self.assertNumQueries(5):
+            response = self.client.get(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['ingredients']), 5)
+        self.assertEqual(len(response.data['tags']), 3)
+
+    def test_is_favorited_composes_with_filters(self):
+        self.client.force_authenticate(self.user)
+        expected = {f'Рецепт {number}' for number in range(100)
+                    if number % 4 == 0 and number % 3 == 2}
+        self.client.get('/api/recipes/?tags=tag-2')
+        # Запросы ленты и проверка автора фильтром (для ETag и для
+        # страницы): EXISTS не добавляет запросов и не ломает предвыборку.
+        with self.assertNumQueries(7):
+            response = self.client.get(
+                f'/api/recipes/?is_favorited=1&tags=tag-2'
+                f'&author={self.author.pk}&limit=100'
+            )
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results']
+        self.assertEqual({recipe['name'] for recipe in results}, expected)
+        self.assertTrue(all(recipe['is_favorited'] for recipe in results))
+        self.assertTrue(all(len(recipe['tags']) == 3 for recipe in results))
+
+    def test_is_favorited_is_empty_for_anonymous(self):
+        response = self.client.get('/api/recipes/?is_favorited=1')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 0)
+
+    def test_is_favorited_uses_index(self):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = Recipe.objects.favorited_by(self.user).with_tags(
+            [self.tags[0].pk]
+        ).explain()
+        lines = [line.lower() for line in plan.splitlines()
+                 if Favorite._meta.db_table in line]
+        self.assertTrue(lines, plan)
+        self.assertTrue(all('index' in line for line in lines), plan)
+
+    def test_etag_follows_viewer_state(self):
+        # В TestCase on_commit не выполняется, и версии в кэше не меняются:
+        # ETag должен измениться только из-за состояния читателя в базе.
+        self.client.force_authenticate(self.user)
+        recipe = Recipe.objects.get(name='Рецепт 14')
+        cart = f'/api/recipes/{recipe.pk}/shopping_cart/'
+        for url in ('/api/recipes/', f'/api/recipes/{recipe.pk}/'):
+            with self.subTest(url=url):
+                etag = self.client.get(url)['ETag']
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(self.client.get(cart).status_code, 201)
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(self.client.delete(cart).status_code, 204)
+
+    def test_cursor_rejects_custom_ordering(self):
+        response = self.client.get('/api/recipes/?cursor=&limit=6')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), 6)
+        response = self.client.get(
+            '/api/recipes/?cursor=&ordering=-favorites_count'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('cursor', response.data)
+
+
+@override_settings(CACHES=TEST_CACHES, QUERY_BUDGETS_STRICT=True)
+class CatalogueTests(APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Tag.objects.create(name='Завтрак', slug='breakfast', color='#E26C2D')
+
+    def test_cached_json_and_browsable_api(self):
+        response = self.client.get('/api/tags/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.json()[0]['slug'], 'breakfast')
+        response = self.client.get('/api/tags/?format=api',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/html'))
+        self.assertContains(response, 'breakfast')
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RemoveDuplicatesTests(TransactionTestCase):
+    """remove_duplicates готовит базу без уникальных ограничений к
+    migrate, который их добавит."""
+    models = (Favorite, ShoppingCart, Ingredient, IngredientRecipe)
+
+    def setUp(self):
+        # SQLite пересоздаёт таблицу по _meta.constraints, поэтому на
+        # время удаления ограничения модель объявляется без них.
+        with connection.schema_editor() as editor:
+            for model in self.models:
+                constraints = model._meta.constraints
+                with mock.patch.object(model._meta, 'constraints', []):
+                    for constraint in constraints:
+                        editor.remove_constraint(model, constraint)
+
+    def tearDown(self):
+        with connection.schema_editor() as editor:
+            for model in self.models:
+                for constraint in model._meta.constraints:
+                    editor.add_constraint(model, constraint)
+
+    def test_duplicates_removed_and_merged(self):
+        user = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Авторов', password='pass'
+        )
+        salt, copy = (
+            Ingredient.objects.create(name='соль', measurement_unit='г')
+            for _ in range(2)
+        )
+        recipe = Recipe.objects.create(
+            author=user, name='Рецепт', text='Текст', image=IMAGE,
+            has_image_variants=True, cooking_time=10
+        )
+        for ingredient, amount in ((salt, 5), (copy, 7), (salt, 1)):
+            IngredientRecipe.objects.bulk_create([IngredientRecipe(
+                recipe=recipe, ingredient=ingredient, amount=amount
+            )])
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                model(user=user, recipe=recipe) for _ in range(3)
+            )
+        call_command('remove_duplicates', stdout=io.StringIO())
+        self.assertEqual(Favorite.objects.count(), 1)
+        self.assertEqual(ShoppingCart.objects.count(), 1)
+        self.assertEqual(list(Ingredient.objects.values_list('pk')),
+                         [(salt.pk, )])
+        self.assertEqual(
+            list(IngredientRecipe.objects.values_list('ingredient', 'amount')),
+            [(salt.pk, 13)]
+        )
+
+
+@override_settings(CACHES=TEST_CACHES, QUERY_BUDGETS_STRICT=True)
+class ShoppingListApiTests(APITestCase):
+    """Список покупок после действий через API совпадает с
+    пересчитанным по корзинам."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Авторов', password='pass'
+        )
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Рецепт', text='Текст', image=IMAGE,
+            has_image_variants=True, cooking_time=10
+        )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=cls.recipe, ingredient=ingredient,
+                             amount=10)
+            for ingredient in cls.ingredients[:2]
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.author)
+
+    def assertListConsistent(self):
+        self.assertEqual(
+            set(ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )),
+            set(ShoppingListItem.objects.expected())
+        )
+
+    def test_cart_update_and_delete(self):
+        url = f'/api/recipes/{self.recipe.pk}/'
+        response = self.client.get(url + 'shopping_cart/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ShoppingListItem.objects.count(), 2)
+        response = self.client.patch(url, {'ingredients': [
+            {'id': self.ingredients[1].pk, 'amount': 5},
+            {'id': self.ingredients[2].pk, 'amount': 7},
+        ]}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertListConsistent()
+        self.assertEqual(ShoppingListItem.objects.count(), 2)
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_download_formats(self):
+        self.client.get(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        url = '/api/recipes/download_shopping_cart/?type='
+        for extension, start in (('csv', '\ufeff'.encode()),
+                                 ('txt', b'\n'), ('pdf', b'%PDF')):
+            with self.subTest(extension=extension):
+                response = self.client.get(url + extension)
+                self.assertEqual(response.status_code, 200)
+                content = b''.join(response.streaming_content)
+                self.assertTrue(content.startswith(start))
+                self.assertIn(f'Shoppingcart.{extension}',
+                              response['Content-Disposition'])
+        self.assertEqual(self.client.get(url + 'xls').status_code, 400)
+
+    def test_pdf_larger_than_memory_limit(self):
+        # Документ больше порога записывается на диск.
+        self.client.get(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        with mock.patch.object(PdfRenderer, 'max_memory_size', 100):
+            response = self.client.get(
+                '/api/recipes/download_shopping_cart/?type=pdf'
+            )
+        content = b''.join(response.streaming_content)
+        self.assertTrue(content.startswith(b'%PDF'))
+        self.assertTrue(content.rstrip().endswith(b'%%EOF'))
+
+
+class RecipeImageFieldTests(SimpleTestCase):
+    """Строка base64 декодируется одинаково при любых границах частей."""
+
+    def setUp(self):
+        buffer = io.BytesIO()
+        Image.effect_noise((64, 64), 50).save(buffer, 'PNG')
+        self.image = buffer.getvalue()
+        self.field = RecipeImageField()
+        self.field.chunk_size = 1000
+
+    def decode(self, encoded):
+        file = self.field.decode('data:image/png;base64,' + encoded)
+        with file:
+            self.assertEqual(file.name, 'image.png')
+            return file.read()
+
+    def test_plain_and_mime_wrapped(self):
+        # encodebytes переносит строку каждые 76 символов, как MIME.
+        for encoded in (base64.b64encode(self.image).decode(),
+                        base64.encodebytes(self.image).decode(),
+                        base64.encodebytes(self.image).decode().replace(
+                            '\n', '\r\n')):
+            with self.subTest(length=len(encoded)):
+                self.assertEqual(self.decode(encoded), self.image)
+
+    def test_invalid_input(self):
+        encoded = base64.b64encode(self.image).decode()
+        for encoded in (encoded[:1500] + 'ё' + encoded[1500:],
+                        encoded[:len(encoded) // 2 + 1], encoded[:40]):
+            with self.subTest(length=len(encoded)):
+                with self.assertRaises(ValidationError):
+                    self.decode(encoded)
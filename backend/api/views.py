@@ -1,32 +1,42 @@
-import csv
-
-from django.db.models import Sum
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Prefetch, Subquery, Sum
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                            ShoppingCart, Tag)
+from recipes.autocomplete import autocomplete
+from recipes.catalogue import get_or_build, get_version
+from recipes.ingredient_index import ingredient_index
+from recipes.models import (Favorite, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListItem, Tag)
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.pagination import LimitOffsetPagination
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from users.models import Subscribe, User
 
-from .filters import IngredientFilter, RecipeFilter
-from .mixins import RetrieveListViewSet
+from .filters import RecipeFilter
+from .mixins import ConditionalGetMixin, RetrieveListViewSet
+from .pagination import RecipePagination, UserPagination
+from .parsers import RecipeJSONParser, RecipeMultiPartParser
 from .permissions import IsAuthorAdminOrReadOnly
+from .renderers import FastJSONRenderer
 from .serializers import (CustomUserSerializer, FavoriteSerializer,
                           IngredientSerializer, PasswordSerializer,
                           RecipeCreateSerializer, RecipeListSerializer,
-                          ShoppingCartSerializer, SubscribeSerializer,
-                          TagSerializer)
+                          RecipeMatchSerializer, ShoppingCartSerializer,
+                          SubscribeSerializer, TagSerializer)
+from .shopping_list import SHOPPING_LIST_RENDERERS
 
 
 class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
+    pagination_class = UserPagination
+    query_budgets = {'list': 5, 'retrieve': 4, 'me': 3, 'subscriptions': 6,
+                     'subscribe': 8}
 
     @action(detail=False,
             methods=['post'],
@@ -52,7 +62,14 @@ class CustomUserViewSet(UserViewSet):
             permission_classes=(IsAuthenticated, ))
     def subscriptions(self, request):
         user = request.user
-        queryset = User.objects.filter(follower__user=user)
+        queryset = User.objects.filter(following__user=user)
+        recipes = Recipe.objects.all()
+        limit = request.query_params.get('recipes_limit')
+        if limit is not None:
+            recipes = recipes.limit_per_author(int(limit))
+        queryset = queryset.prefetch_related(
+            Prefetch('recipes', queryset=recipes)
+        )
         pages = self.paginate_queryset(queryset)
         serializer = SubscribeSerializer(
             pages,
@@ -93,28 +110,168 @@ class CustomUserViewSet(UserViewSet):
             return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class TagsViewSet(RetrieveListViewSet):
+class CatalogueViewSet(ConditionalGetMixin, RetrieveListViewSet):
+    """Справочник, список которого отдаётся готовым JSON из кэша."""
+    catalogue_name = None
+    query_budgets = {'list': 3, 'retrieve': 3}
+
+    def get_list_etag(self, request):
+        return (request.get_full_path(), get_version(self.catalogue_name))
+
+    def get_object_etag(self, request):
+        return (self.kwargs['pk'], get_version(self.catalogue_name))
+
+    def build_catalogue(self):
+        serializer = self.get_serializer(self.queryset.all(), many=True)
+        return FastJSONRenderer().render(serializer.data)
+
+    def list(self, request, *args, **kwargs):
+        """Готовый JSON из кэша отдаётся, только если выбран JSON без
+        отступов; для API в браузере и других форматов — обычный ответ."""
+        renderer = request.accepted_renderer
+        if (not isinstance(renderer, FastJSONRenderer)
+                or renderer.get_indent(request.accepted_media_type,
+                                       {}) is not None):
+            return super().list(request, *args, **kwargs)
+        return self.conditional_response(
+            request,
+            self.get_list_etag(request),
+            lambda: HttpResponse(
+                get_or_build(self.catalogue_name, self.build_catalogue),
+                content_type='application/json'
+            )
+        )
+
+
+class TagsViewSet(CatalogueViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny, )
     pagination_class = None
+    catalogue_name = 'tags'
 
 
-class IngredientsViewSet(RetrieveListViewSet):
+class IngredientsViewSet(CatalogueViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny, )
-    filter_backends = (DjangoFilterBackend, )
-    filterset_class = IngredientFilter
     pagination_class = None
+    catalogue_name = 'ingredients'
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if name:
+            return self.conditional_response(
+                request,
+                self.get_list_etag(request),
+                lambda: Response(autocomplete(name))
+            )
+        return super().list(request, *args, **kwargs)
 
-class RecipesViewSet(viewsets.ModelViewSet):
+
+class RecipesViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
     serializer_class = RecipeListSerializer
     permission_classes = (IsAuthorAdminOrReadOnly,)
     filter_backends = (DjangoFilterBackend, )
     filterset_class = RecipeFilter
+    pagination_class = RecipePagination
+    parser_classes = (RecipeJSONParser, RecipeMultiPartParser)
+    query_budgets = {
+        'list': 8, 'retrieve': 7, 'create': 18, 'update': 28,
+        'partial_update': 28, 'destroy': 20, 'favorite': 7,
+        'shopping_cart': 15, 'download_shopping_cart': 3, 'what_to_cook': 7,
+    }
+
+    def get_queryset(self):
+        return Recipe.objects.for_feed(self.request.user)
+
+    def get_versions(self, request):
+        """Версии справочников, от которых зависит представление рецепта."""
+        return [get_version(name) for name in ('tags', 'ingredients', 'users')]
+
+    def get_viewer_state(self, request):
+        """Подзапросы с последним id и числом записей избранного, корзины
+        и подписок читателя.
+
+        Состояние читается из базы тем же запросом, что и состояние
+        рецептов, поэтому ETag меняется сразу во всех воркерах.
+        """
+        if not request.user.is_authenticated:
+            return {}
+        state = {}
+        for model in (Favorite, ShoppingCart, Subscribe):
+            rows = model.objects.filter(
+                user=request.user.id
+            ).order_by().values('user')
+            for name, aggregate in (('last', Max('id')),
+                                    ('count', Count('id'))):
+                state[f'{model._meta.model_name}_{name}'] = Subquery(
+                    rows.annotate(value=aggregate).values('value')
+                )
+        return state
+
+    def get_list_etag(self, request):
+        viewer = {name: Max(value) for name, value
+                  in self.get_viewer_state(request).items()}
+        state = self.filter_queryset(self.get_queryset()).aggregate(
+            updated_at=Max('updated_at'), count=Count('id'),
+            favorites=Sum('favorites_count'), **viewer
+        )
+        self.paginator.known_count = state['count']
+        return (request.get_full_path(), state, self.get_versions(request))
+
+    def list(self, request, *args, **kwargs):
+        if not self.paginator.uses_cursor(request):
+            return super().list(request, *args, **kwargs)
+        return self.cursor_list(request)
+
+    def cursor_list(self, request):
+        """Страница по курсору.
+
+        ETag строится по записям самой страницы, а не по агрегатам всей
+        выборки: иначе каждая страница снова проходила бы всю таблицу, от
+        чего курсор и избавляет. Подписки читателя загружаются один раз
+        и для ETag, и для сериализатора.
+        """
+        page = self.paginate_queryset(
+            self.filter_queryset(self.get_queryset())
+        )
+        context = self.get_serializer_context()
+        subscribed = []
+        if request.user.is_authenticated:
+            context['subscribed_ids'] = set(
+                Subscribe.objects.filter(user=request.user).values_list(
+                    'author_id', flat=True
+                )
+            )
+            subscribed = sorted(context['subscribed_ids'].intersection(
+                recipe.author_id for recipe in page
+            ))
+        state = (
+            request.get_full_path(), self.paginator.count,
+            self.paginator.has_next, subscribed, self.get_versions(request),
+            [(recipe.pk, recipe.updated_at,
+              getattr(recipe, 'is_favorited', None),
+              getattr(recipe, 'is_in_shopping_cart', None))
+             for recipe in page],
+        )
+        return self.conditional_response(
+            request, state, lambda: self.get_paginated_response(
+                self.get_serializer(page, many=True, context=context).data
+            )
+        )
+
+    def get_object_etag(self, request):
+        if not self.kwargs['pk'].isdigit():
+            return None
+        viewer = self.get_viewer_state(request)
+        state = Recipe.objects.filter(pk=self.kwargs['pk']).annotate(
+            **viewer
+        ).values('updated_at', *viewer).first()
+        if state is None:
+            return None
+        return (self.kwargs['pk'], state, self.get_versions(request))
 
     def get_serializer_class(self):
         if self.request.method == 'GET':
@@ -127,65 +284,102 @@ class RecipesViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         serializer.save()
 
+    def toggle(self, model, request, pk):
+        """Добавляет рецепт в model при GET и удаляет при DELETE.
+
+        Возвращает рецепт и признак того, что запись действительно
+        добавилась или удалилась. Одновременные запросы разводит
+        уникальное ограничение (user, recipe), а не предварительная
+        проверка.
+        """
+        recipe = get_object_or_404(Recipe, pk=pk)
+        if request.method == 'DELETE':
+            deleted, _ = model.objects.filter(
+                user=request.user, recipe=recipe
+            ).delete()
+            return recipe, bool(deleted)
+        try:
+            with transaction.atomic():
+                model.objects.create(user=request.user, recipe=recipe)
+        except IntegrityError:
+            return recipe, False
+        return recipe, True
+
     @action(
         methods=['get', 'delete'],
         detail=True,
         permission_classes=(IsAuthenticated, )
     )
     def favorite(self, request, pk=None):
-        user = self.request.user
-        recipe = get_object_or_404(Recipe, pk=pk)
-        in_favorite = Favorite.objects.filter(
-            user=user, recipe=recipe
-        )
-        if user.is_anonymous:
-            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        recipe, changed = self.toggle(Favorite, request, pk)
         if request.method == 'GET':
-            if not in_favorite:
-                favorite = Favorite.objects.create(user=user, recipe=recipe)
-                serializer = FavoriteSerializer(favorite.recipe)
-                return Response(
-                    data=serializer.data,
-                    status=status.HTTP_201_CREATED
-                )
-        elif request.method == 'DELETE':
-            if not in_favorite:
-                data = {'errors': 'Такого рецепта нет в избранных.'}
+            if not changed:
+                data = {'errors': 'Этот рецепт уже в избранном.'}
                 return Response(data=data, status=status.HTTP_400_BAD_REQUEST)
-            in_favorite.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+            serializer = FavoriteSerializer(recipe)
+            return Response(
+                data=serializer.data,
+                status=status.HTTP_201_CREATED
+            )
+        if not changed:
+            data = {'errors': 'Такого рецепта нет в избранных.'}
+            return Response(data=data, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
         detail=True,
         methods=["get", "delete"],
         permission_classes=[IsAuthenticated, ],
     )
+    @transaction.atomic
     def shopping_cart(self, request, pk=None):
-        user = self.request.user
-        recipe = get_object_or_404(Recipe, pk=pk)
-        in_shopping_cart = ShoppingCart.objects.filter(
-            user=user,
-            recipe=recipe
-        )
-        if user.is_anonymous:
-            return Response(status=status.HTTP_401_UNAUTHORIZED)
+        recipe, changed = self.toggle(ShoppingCart, request, pk)
         if request.method == 'GET':
-            if not in_shopping_cart:
-                shopping_cart = ShoppingCart.objects.create(
-                    user=user,
-                    recipe=recipe
-                )
-                serializer = ShoppingCartSerializer(shopping_cart.recipe)
-                return Response(
-                    data=serializer.data,
-                    status=status.HTTP_201_CREATED
-                )
-        elif request.method == 'DELETE':
-            if not in_shopping_cart:
-                data = {'errors': 'Такой рецепта нет в списке покупок.'}
+            if not changed:
+                data = {'errors': 'Этот рецепт уже в списке покупок.'}
                 return Response(data=data, status=status.HTTP_400_BAD_REQUEST)
-            in_shopping_cart.delete()
-            return Response(status=status.HTTP_204_NO_CONTENT)
+            serializer = ShoppingCartSerializer(recipe)
+            return Response(
+                data=serializer.data,
+                status=status.HTTP_201_CREATED
+            )
+        if not changed:
+            data = {'errors': 'Такой рецепта нет в списке покупок.'}
+            return Response(data=data, status=status.HTTP_400_BAD_REQUEST)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(methods=['get'], detail=False)
+    def what_to_cook(self, request):
+        """Рецепты, для которых есть больше всего ингредиентов
+        из ?ingredients=1,2,3."""
+        try:
+            ingredient_ids = {
+                int(value)
+                for param in request.query_params.getlist('ingredients')
+                for value in param.split(',') if value
+            }
+        except ValueError:
+            data = {'errors': 'Ингредиенты передаются списком id.'}
+            return Response(data=data, status=status.HTTP_400_BAD_REQUEST)
+        if not ingredient_ids:
+            data = {'errors': 'Нужно выбрать минимум 1 ингридиент!'}
+            return Response(data=data, status=status.HTTP_400_BAD_REQUEST)
+        paginator = LimitOffsetPagination()
+        page = paginator.paginate_queryset(
+            ingredient_index.match(ingredient_ids), request, self
+        )
+        recipes = Recipe.objects.for_feed(request.user).in_bulk(
+            [recipe_id for recipe_id, _ in page]
+        )
+        matches = []
+        for recipe_id, coverage in page:
+            if recipe_id in recipes:
+                recipes[recipe_id].coverage = round(coverage, 2)
+                matches.append(recipes[recipe_id])
+        serializer = RecipeMatchSerializer(
+            matches, many=True, context={'request': request}
+        )
+        return paginator.get_paginated_response(serializer.data)
 
     @action(
         methods=['get'],
@@ -197,18 +391,21 @@ class RecipesViewSet(viewsets.ModelViewSet):
         user = self.request.user
         if user.is_anonymous:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
-        ingredients = IngredientRecipe.objects.filter(
-            recipe__shopping_cart__user=request.user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(ingredient_amount=Sum('amount')).values_list(
+        renderer_class = SHOPPING_LIST_RENDERERS.get(
+            request.query_params.get('type', 'csv')
+        )
+        if renderer_class is None:
+            data = {'errors': 'Такой формат списка покупок не поддерживается.'}
+            return Response(data=data, status=status.HTTP_400_BAD_REQUEST)
+        renderer = renderer_class()
+        ingredients = ShoppingListItem.objects.filter(
+            user=request.user
+        ).values_list(
             'ingredient__name', 'ingredient__measurement_unit',
-            'ingredient_amount')
-        response = HttpResponse(content_type='text/csv')
-        response['Content-Disposition'] = ('attachment;'
-                                           'filename="Shoppingcart.csv"')
-        response.write(u'\ufeff'.encode('utf8'))
-        writer = csv.writer(response)
-        for item in list(ingredients):
-            writer.writerow(item)
+            'total_amount'
+        ).order_by('ingredient__name')
+        response = renderer.get_response(ingredients.iterator())
+        response['Content-Disposition'] = (
+            f'attachment;filename="{renderer.get_filename()}"'
+        )
         return response
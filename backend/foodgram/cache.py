@@ -0,0 +1,29 @@
+import fcntl
+import os
+
+from django.core.cache.backends import filebased
+
+
+class FileBasedCache(filebased.FileBasedCache):
+    """Файловый кэш, общий для всех воркеров на одной машине.
+
+    Стандартный incr читает и записывает значение без блокировки, и два
+    процесса могут получить одно и то же число, а записывает его со
+    сроком хранения по умолчанию. Здесь incr выполняется под файловой
+    блокировкой и сохраняет значение без срока хранения, поэтому номера
+    версий справочников не теряются, не повторяются и не истекают.
+    """
+
+    def incr(self, key, delta=1, version=None):
+        os.makedirs(self._dir, 0o700, exist_ok=True)
+        with open(os.path.join(self._dir, 'incr.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                value = self.get(key, version=version)
+                if value is None:
+                    raise ValueError(f"Key '{key}' not found")
+                value += delta
+                self.set(key, value, timeout=None, version=version)
+                return value
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
@@ -0,0 +1,37 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+class ConnectionHealthCheckMiddleware:
+    """Проверяет постоянные соединения с базой, простоявшие без запросов
+    дольше DB_CONN_HEALTH_CHECK_IDLE секунд, и закрывает оборвавшиеся,
+    чтобы запрос открыл новое, а не упал на первом SQL-запросе.
+
+    Под нагрузкой соединение только что обслужило предыдущий запрос и не
+    проверяется, так что лишнего SELECT 1 на каждый запрос нет. В Django
+    4.1 похожее делает CONN_HEALTH_CHECKS.
+    """
+
+    def __init__(self, get_response):
+        if not settings.DB_CONN_HEALTH_CHECKS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.idle = settings.DB_CONN_HEALTH_CHECK_IDLE
+        # Соединения у каждого потока свои, поэтому и время простоя тоже.
+        self.local = threading.local()
+
+    def __call__(self, request):
+        if time.monotonic() - getattr(self.local, 'used_at', 0) > self.idle:
+            for connection in connections.all():
+                if (connection.connection is not None
+                        and not connection.in_atomic_block
+                        and not connection.is_usable()):
+                    connection.close()
+        try:
+            return self.get_response(request)
+        finally:
+            self.local.used_at = time.monotonic()
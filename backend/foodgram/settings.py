@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -30,6 +31,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'foodgram.middleware.ConnectionHealthCheckMiddleware',
+    'api.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,9 +71,21 @@ DATABASES = {
         'PASSWORD': os.getenv('POSTGRES_PASSWORD'),
         'HOST': os.getenv('DB_HOST', default='db'),
         'PORT': os.getenv('DB_PORT'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', default=60)),
+        # Для PgBouncer в режиме пула транзакций.
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv(
+            'DB_DISABLE_SERVER_SIDE_CURSORS', default='False'
+        ) == 'True',
     }
 }
 
+DB_CONN_HEALTH_CHECKS = os.getenv(
+    'DB_CONN_HEALTH_CHECKS', default='True'
+) == 'True'
+DB_CONN_HEALTH_CHECK_IDLE = float(
+    os.getenv('DB_CONN_HEALTH_CHECK_IDLE', default=10)
+)
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -93,11 +108,21 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.TokenAuthentication',
     ),
+    'DEFAULT_RENDERER_CLASSES': (
+        'api.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
     'DEFAULT_PAGINATION_CLASS':
         'rest_framework.pagination.LimitOffsetPagination',
     'PAGE_SIZE': 6,
 }
 
+CURSOR_COUNT_CACHE_TIMEOUT = 60
+
+QUERY_BUDGETS_STRICT = os.getenv(
+    'QUERY_BUDGETS_STRICT', default='False'
+) == 'True'
+
 DJOSER = {
     'HIDE_USERS': False,
     'LOGIN_FIELD': 'email',
@@ -129,7 +154,54 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = "/media/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': (320, 320),
+    'medium': (960, 960),
+}
+RECIPE_IMAGE_WORKERS = int(os.getenv('RECIPE_IMAGE_WORKERS', default=2))
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', default=5 * 1024 * 1024)
+)
+# base64 длиннее исходных данных на треть, плюс остальные поля рецепта.
+RECIPE_REQUEST_MAX_SIZE = RECIPE_IMAGE_MAX_SIZE * 4 // 3 + 1024 * 1024
+
 AUTH_USER_MODEL = 'users.User'
 
+# Кэш должен быть общим для всех воркеров gunicorn: в нём лежат версии
+# справочников, по которым процессы узнают об изменениях. Версии хранятся
+# в отдельном кэше без срока хранения и с таким запасом MAX_ENTRIES, что
+# их не вытесняют ни данные справочников, ни счётчики страниц.
+CACHE_BACKEND = os.getenv(
+    'CACHE_BACKEND', default='foodgram.cache.FileBasedCache'
+)
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('CACHE_LOCATION', default=os.path.join(
+            tempfile.gettempdir(), 'foodgram_cache'
+        )),
+        'OPTIONS': {'MAX_ENTRIES': 3000},
+    },
+    'versions': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv('VERSION_CACHE_LOCATION', default=os.path.join(
+            tempfile.gettempdir(), 'foodgram_versions'
+        )),
+        'KEY_PREFIX': 'versions',
+        'TIMEOUT': None,
+        'OPTIONS': {'MAX_ENTRIES': 10 ** 6},
+    },
+}
+
+CATALOGUE_CACHE_TIMEOUT = 60 * 60 * 24
+
+INGREDIENT_AUTOCOMPLETE_LIMIT = 20
+INGREDIENT_AUTOCOMPLETE_CACHE_SIZE = 1024
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    default='/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
+
 EMAIL_BACKEND = 'django.core.mail.backends.filebased.EmailBackend'
 EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
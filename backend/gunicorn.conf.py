@@ -0,0 +1,22 @@
+"""Настройки gunicorn из переменных окружения.
+
+Каждый поток каждого воркера держит своё постоянное соединение с базой
+(DB_CONN_MAX_AGE), поэтому GUNICORN_WORKERS * GUNICORN_THREADS должно
+быть меньше max_connections PostgreSQL или размера пула PgBouncer.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+workers = int(os.getenv(
+    'GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1
+))
+threads = int(os.getenv('GUNICORN_THREADS', 1))
+worker_class = os.getenv(
+    'GUNICORN_WORKER_CLASS', 'gthread' if threads > 1 else 'sync'
+)
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 100))
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
@@ -1,7 +1,7 @@
 from django.contrib import admin
 
 from .models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                     ShoppingCart, Tag)
+                     ShoppingCart, ShoppingListItem, Tag)
 
 EMPTY_VALUE = '-пусто-'
 
@@ -39,7 +39,11 @@ class RecipeAdmin(admin.ModelAdmin):
     empty_value_display = EMPTY_VALUE
 
     def is_favorited(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
+        return obj.favorites_count
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Recipe.objects.filter(pk=form.instance.pk).update_search_vector()
 
 
 @admin.register(Favorite)
@@ -58,3 +62,12 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     search_fields = ('user',)
     list_filter = ('user',)
     empty_value_display = EMPTY_VALUE
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    """Представляет модель ShoppingListItem в интерфейсе администратора."""
+    list_display = ('id', 'user', 'ingredient', 'total_amount')
+    search_fields = ('user',)
+    list_filter = ('user',)
+    empty_value_display = EMPTY_VALUE
@@ -0,0 +1,24 @@
+"""Подсказки ингредиентов для формы рецепта.
+
+Популярные запросы кэшируются в памяти процесса вместе с версией
+справочника ингредиентов, поэтому после его изменения кэш не читается.
+"""
+from functools import lru_cache
+
+from django.conf import settings
+
+from .catalogue import get_version
+from .models import Ingredient
+
+
+@lru_cache(maxsize=settings.INGREDIENT_AUTOCOMPLETE_CACHE_SIZE)
+def _autocomplete(name, version):
+    return tuple(Ingredient.objects.autocomplete(name).values(
+        'id', 'name', 'measurement_unit'
+    )[:settings.INGREDIENT_AUTOCOMPLETE_LIMIT])
+
+
+def autocomplete(name):
+    return list(_autocomplete(
+        name.strip().lower(), get_version('ingredients')
+    ))
@@ -0,0 +1,60 @@
+"""Версионированный кэш справочников (тегов и ингредиентов).
+
+Номер версии каждого справочника хранится в кэше versions, где ключи не
+истекают и не вытесняются, и увеличивается при любом изменении
+справочника. Готовые данные лежат в
+двух уровнях: в памяти процесса и в общем кэше под ключом с номером
+версии, так что старые данные после изменения просто перестают читаться.
+Чтобы изменения были видны всем процессам, в CACHES нужен общий бэкенд:
+по умолчанию это файловый кэш, общий для воркеров на одной машине, для
+нескольких машин — memcached. С locmem каждый воркер видел бы только
+свои изменения и отдавал бы устаревшие справочники до перезапуска.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache, caches
+
+_local = {}
+
+
+def _version_key(name):
+    return f'catalogue:{name}:version'
+
+
+def get_version(name):
+    versions = caches['versions']
+    version = versions.get(_version_key(name))
+    if version is None:
+        versions.add(_version_key(name), time.time_ns(), timeout=None)
+        version = versions.get(_version_key(name))
+    return version
+
+
+def bump_version(name):
+    """Увеличивает версию справочника name и возвращает новую."""
+    try:
+        return caches['versions'].incr(_version_key(name))
+    except ValueError:
+        return get_version(name)
+
+
+def get_or_build(name, build, part=None):
+    """Данные справочника name текущей версии; build строит их заново.
+
+    part отличает разные представления одного справочника, которые
+    устаревают вместе с ним.
+    """
+    version = get_version(name)
+    if part is not None:
+        name = f'{name}:{part}'
+    local = _local.get(name)
+    if local is not None and local[0] == version:
+        return local[1]
+    key = f'catalogue:{name}:{version}'
+    data = cache.get(key)
+    if data is None:
+        data = build()
+        cache.set(key, data, settings.CATALOGUE_CACHE_TIMEOUT)
+    _local[name] = (version, data)
+    return data
@@ -0,0 +1,104 @@
+"""Уменьшенные копии картинок рецептов.
+
+После сохранения рецепта с новой картинкой её копии из
+RECIPE_IMAGE_VARIANTS (thumbnail для карточек, medium для страницы
+рецепта) в исходном формате и в WebP строятся вне запроса, в пуле из
+RECIPE_IMAGE_WORKERS потоков; при RECIPE_IMAGE_WORKERS = 0 — сразу после
+коммита в том же потоке. Пока копии не готовы, API отдаёт исходную
+картинку.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.utils import timezone
+
+from PIL import Image
+
+from .storage import image_storage
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def variant_name(name, variant, extension=None):
+    root, original = os.path.splitext(name)
+    return f'{root}_{variant}{extension or original}'
+
+
+def variant_names(name):
+    """Имена копий картинки name: {'thumbnail': ..., 'thumbnail_webp': ...}."""
+    names = {}
+    for variant in settings.RECIPE_IMAGE_VARIANTS:
+        names[variant] = variant_name(name, variant)
+        names[f'{variant}_webp'] = variant_name(name, variant, '.webp')
+    return names
+
+
+def save_image(image, name, image_format):
+    buffer = BytesIO()
+    image.save(buffer, image_format)
+    image_storage.save_derived(name, ContentFile(buffer.getvalue()))
+
+
+def build_variants(name):
+    names = variant_names(name).values()
+    if all(image_storage.exists(variant) for variant in names):
+        return
+    with image_storage.open(name) as file:
+        original = Image.open(file)
+        original.load()
+    for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+        image = original.copy()
+        image.thumbnail(size)
+        save_image(image, variant_name(name, variant), original.format)
+        save_image(image, variant_name(name, variant, '.webp'), 'WEBP')
+
+
+def process(recipe_id, name):
+    """Строит копии картинки и отмечает их готовность, если картинка
+    рецепта за это время не сменилась."""
+    from .models import Recipe
+
+    try:
+        build_variants(name)
+    except Exception:
+        logger.exception('Не удалось построить копии картинки %s', name)
+        return
+    Recipe.objects.filter(pk=recipe_id, image=name).update(
+        has_image_variants=True, updated_at=timezone.now()
+    )
+
+
+def _process_in_worker(recipe_id, name):
+    try:
+        process(recipe_id, name)
+    finally:
+        connection.close()
+
+
+def submit(recipe_id, name):
+    global _executor
+    if not settings.RECIPE_IMAGE_WORKERS:
+        process(recipe_id, name)
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.RECIPE_IMAGE_WORKERS,
+                thread_name_prefix='recipe-images'
+            )
+    _executor.submit(_process_in_worker, recipe_id, name)
+
+
+def schedule(recipe):
+    """Ставит построение копий картинки рецепта в очередь после коммита."""
+    recipe_id, name = recipe.pk, recipe.image.name
+    transaction.on_commit(lambda: submit(recipe_id, name))
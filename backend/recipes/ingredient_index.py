@@ -0,0 +1,154 @@
+"""Обратный индекс «ингредиент → рецепты» для подбора рецептов по
+продуктам, которые уже есть у пользователя.
+
+Для каждого ингредиента хранится отсортированный массив id рецептов,
+для рецептов — компактный массив числа их ингредиентов, индексированный
+по id рецепта. Индекс строится в памяти процесса при первом обращении и
+помечается версией из общего кэша.
+
+Изменение строк ингредиентов рецептов (через API, админку или каскадное
+удаление) после коммита увеличивает версию и кладёт в общий кэш дельту
+под её номером: список изменений рецептов. Процесс, изменивший данные,
+применяет дельту сразу, а остальные, увидев новую версию, дочитывают
+пропущенные дельты; индекс заново строится из базы, только если какой-то
+дельты в кэше уже нет или их слишком много.
+"""
+import threading
+from array import array
+from bisect import bisect_left
+
+from django.core.cache import cache
+from django.db import transaction
+
+from .catalogue import bump_version, get_version
+from .models import IngredientRecipe
+
+VERSION_NAME = 'ingredient_index'
+# Больше дельт дешевле перестроить индекс, чем применять по одной.
+MAX_DELTAS = 1000
+DELTA_TIMEOUT = 60 * 60
+
+
+def _delta_key(version):
+    return f'ingredient_index:deltas:{version}'
+
+
+class IngredientIndex:
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.version = None
+        self.postings = {}
+        self.counts = array('H')
+
+    def rebuild(self):
+        # Пока индекс не достроен, он не считается ни одной версией.
+        self.version = None
+        self.postings = {}
+        self.counts = array('H')
+        rows = IngredientRecipe.objects.order_by(
+            'ingredient_id', 'recipe_id'
+        ).values_list('ingredient_id', 'recipe_id')
+        for ingredient_id, recipe_id in rows.iterator():
+            self.postings.setdefault(
+                ingredient_id, array('l')
+            ).append(recipe_id)
+            self._count(recipe_id, 1)
+
+    def _count(self, recipe_id, delta):
+        if recipe_id >= len(self.counts):
+            size = max(recipe_id + 1, 2 * len(self.counts))
+            self.counts.frombytes(
+                bytes((size - len(self.counts)) * self.counts.itemsize)
+            )
+        self.counts[recipe_id] += delta
+
+    def apply(self, recipe_id, added, removed):
+        """Убирает у рецепта ингредиенты removed и добавляет added."""
+        for ingredient_id in removed:
+            posting = self.postings.get(ingredient_id, ())
+            position = bisect_left(posting, recipe_id)
+            if position < len(posting) and posting[position] == recipe_id:
+                del posting[position]
+                self._count(recipe_id, -1)
+        for ingredient_id in added:
+            posting = self.postings.setdefault(ingredient_id, array('l'))
+            position = bisect_left(posting, recipe_id)
+            if position == len(posting) or posting[position] != recipe_id:
+                posting.insert(position, recipe_id)
+                self._count(recipe_id, 1)
+
+    def catch_up(self, version):
+        """Применяет дельты от текущей версии индекса до version; если
+        какой-то нет, возвращает False."""
+        if self.version is None:
+            return False
+        missing = version - self.version
+        if not 0 < missing <= MAX_DELTAS:
+            return False
+        keys = [_delta_key(self.version + number)
+                for number in range(1, missing + 1)]
+        deltas = cache.get_many(keys)
+        if len(deltas) != len(keys):
+            return False
+        for key in keys:
+            for change in deltas[key]:
+                self.apply(*change)
+        self.version = version
+        return True
+
+    def ensure_current(self):
+        version = get_version(VERSION_NAME)
+        if version != self.version and not self.catch_up(version):
+            self.rebuild()
+            self.version = version
+
+    def change(self, changes):
+        """Публикует изменения рецептов [(id рецепта, added, removed)]
+        одной дельтой под новой версией и применяет их на месте, если
+        индекс процесса был актуален."""
+        delta = tuple(
+            (recipe_id, tuple(added), tuple(removed))
+            for recipe_id, added, removed in changes
+        )
+        if not delta:
+            return
+        with self.lock:
+            version = bump_version(VERSION_NAME)
+            cache.set(_delta_key(version), delta, DELTA_TIMEOUT)
+            if self.version is not None and version == self.version + 1:
+                for change in delta:
+                    self.apply(*change)
+                self.version = version
+
+    def match(self, ingredient_ids):
+        """Рецепты, в которых есть хотя бы один из ingredient_ids.
+
+        Возвращает список (id рецепта, доля имеющихся ингредиентов),
+        отсортированный по убыванию доли, затем числа совпадений.
+        """
+        with self.lock:
+            self.ensure_current()
+            matched = {}
+            for ingredient_id in set(ingredient_ids):
+                for recipe_id in self.postings.get(ingredient_id, ()):
+                    matched[recipe_id] = matched.get(recipe_id, 0) + 1
+            ranking = [
+                (count / self.counts[recipe_id], count, recipe_id)
+                for recipe_id, count in matched.items()
+            ]
+        ranking.sort(reverse=True)
+        return [(recipe_id, coverage) for coverage, _, recipe_id in ranking]
+
+
+ingredient_index = IngredientIndex()
+
+
+def schedule_changes(changes):
+    """Обновляет индекс после коммита текущей транзакции."""
+    changes = list(changes)
+    transaction.on_commit(lambda: ingredient_index.change(changes))
+
+
+def schedule_change(recipe_id, added=(), removed=()):
+    schedule_changes([(recipe_id, added, removed)])
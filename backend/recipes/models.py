@@ -1,9 +1,19 @@
+from itertools import islice
+
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField)
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models, transaction
+from django.db.models.functions import Coalesce
+
+from .storage import image_storage
 
 User = get_user_model()
 
+SEARCH_CONFIG = 'russian'
+
 
 class Tag(models.Model):
     """Модель тегов у рецептов пользователей."""
@@ -30,6 +40,21 @@ class Tag(models.Model):
         return self.name
 
 
+class IngredientQuerySet(models.QuerySet):
+    """Выборки ингредиентов."""
+
+    def autocomplete(self, name):
+        """Ингредиенты, в названии которых есть name; сначала те,
+        что с name начинаются."""
+        return self.filter(name__icontains=name).annotate(
+            is_prefix=models.Case(
+                models.When(name__istartswith=name, then=models.Value(True)),
+                default=models.Value(False),
+                output_field=models.BooleanField()
+            )
+        ).order_by('-is_prefix', 'name')
+
+
 class Ingredient(models.Model):
     """Модель ингредиентов."""
     name = models.CharField('Название', max_length=200)
@@ -38,15 +63,119 @@ class Ingredient(models.Model):
         max_length=200
     )
 
+    objects = IngredientQuerySet.as_manager()
+
     class Meta:
         ordering = ('name', )
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('name', 'measurement_unit', ),
+                name='unique_ingredient'),
+        )
 
     def __str__(self):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+    """Выборки рецептов для ленты и страницы рецепта."""
+
+    def with_user_flags(self, user):
+        if user.is_anonymous:
+            return self
+        return self.annotate(
+            is_favorited=models.Exists(Favorite.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+            is_in_shopping_cart=models.Exists(ShoppingCart.objects.filter(
+                user=user, recipe=models.OuterRef('pk')
+            )),
+        )
+
+    def favorited_by(self, user):
+        if user.is_anonymous:
+            return self.none()
+        return self.filter(models.Exists(Favorite.objects.filter(
+            user=user, recipe=models.OuterRef('pk')
+        )))
+
+    def in_shopping_cart_of(self, user):
+        if user.is_anonymous:
+            return self.none()
+        return self.filter(models.Exists(ShoppingCart.objects.filter(
+            user=user, recipe=models.OuterRef('pk')
+        )))
+
+    def with_tags(self, tag_ids):
+        """Рецепты хотя бы с одним из тегов; EXISTS по промежуточной
+        таблице не даёт дублей и не требует DISTINCT."""
+        return self.filter(models.Exists(
+            self.model.tags.through.objects.filter(
+                recipe_id=models.OuterRef('pk'), tag_id__in=tag_ids
+            )
+        ))
+
+    def limit_per_author(self, limit):
+        """Оставляет не больше limit последних рецептов каждого автора."""
+        latest = self.model.objects.filter(
+            author=models.OuterRef('author')
+        ).values('pk')[:limit]
+        return self.filter(pk__in=models.Subquery(latest))
+
+    def for_feed(self, user):
+        # Поисковый вектор нужен только в SQL поиска, в ответ он не идёт.
+        return self.defer('search_vector').select_related(
+            'author'
+        ).prefetch_related(
+            'tags',
+            models.Prefetch(
+                'ingredient_recipe',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            ),
+        ).with_user_flags(user)
+
+    def update_search_vector(self):
+        """Пересчитывает поисковый вектор: название (вес A), описание (B)
+        и названия ингредиентов (C). Только для PostgreSQL."""
+        if connections[self.db].vendor != 'postgresql':
+            return 0
+        names = IngredientRecipe.objects.filter(
+            recipe=models.OuterRef('pk')
+        ).order_by().values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names')
+        return self.update(search_vector=(
+            SearchVector('name', weight='A', config=SEARCH_CONFIG)
+            + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+            + SearchVector(
+                Coalesce(
+                    models.Subquery(names, output_field=models.TextField()),
+                    models.Value('')
+                ),
+                weight='C',
+                config=SEARCH_CONFIG
+            )
+        ))
+
+    def search(self, value):
+        """Полнотекстовый поиск с сортировкой по релевантности;
+        на остальных СУБД — поиск по вхождению подстроки."""
+        if connections[self.db].vendor != 'postgresql':
+            return self.filter(
+                models.Q(name__icontains=value)
+                | models.Q(text__icontains=value)
+                | models.Q(pk__in=IngredientRecipe.objects.filter(
+                    ingredient__name__icontains=value
+                ).values('recipe'))
+            )
+        query = SearchQuery(value, config=SEARCH_CONFIG)
+        return self.filter(search_vector=query).annotate(
+            rank=SearchRank(models.F('search_vector'), query)
+        ).order_by('-rank', '-pub_date')
+
+
 class Recipe(models.Model):
     """Модель рецептов пользователей."""
     author = models.ForeignKey(
@@ -62,6 +191,7 @@ class Recipe(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='recipes/images/',
+        storage=image_storage
     )
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(
@@ -76,6 +206,21 @@ class Recipe(models.Model):
         'Дата публикации',
         auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        'Дата изменения',
+        auto_now=True
+    )
+    favorites_count = models.PositiveIntegerField(
+        'Добавлений в избранное',
+        default=0,
+        editable=False
+    )
+    has_image_variants = models.BooleanField(
+        'Уменьшенные копии картинки готовы',
+        default=False,
+        editable=False
+    )
+    search_vector = SearchVectorField(null=True, editable=False)
     cooking_time = models.PositiveSmallIntegerField(
         'Время приготовления',
         validators=(
@@ -84,10 +229,19 @@ class Recipe(models.Model):
         )
     )
 
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         ordering = ('-pub_date', )
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = (
+            models.Index(fields=('-pub_date', '-id'), name='recipe_feed_idx'),
+            models.Index(
+                fields=('-favorites_count', '-pub_date'),
+                name='recipe_popular_idx'
+            ),
+        )
 
     def __str__(self):
         return self.name
@@ -118,6 +272,11 @@ class IngredientRecipe(models.Model):
     class Meta:
         verbose_name = 'Количество ингредиента'
         verbose_name_plural = 'Количество ингредиентов'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('recipe', 'ingredient', ),
+                name='unique_ingredient_recipe'),
+        )
 
     def __str__(self):
         return (f'{self.ingredient.name} - {self.amount}'
@@ -142,6 +301,11 @@ class Favorite(models.Model):
     class Meta:
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранные'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe', ),
+                name='unique_favorite'),
+        )
 
 
 class ShoppingCart(models.Model):
@@ -162,3 +326,133 @@ class ShoppingCart(models.Model):
     class Meta:
         verbose_name = 'Покупка'
         verbose_name_plural = 'Покупки'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'recipe', ),
+                name='unique_shopping_cart'),
+        )
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    """Операции над сводным списком покупок."""
+
+    @staticmethod
+    def recipe_amounts(recipe):
+        """Количество каждого ингредиента в рецепте."""
+        return dict(
+            IngredientRecipe.objects.filter(recipe=recipe).values(
+                'ingredient'
+            ).annotate(total=models.Sum('amount')).values_list(
+                'ingredient', 'total'
+            )
+        )
+
+    def change(self, user_ids, amounts):
+        """Прибавляет amounts ({id ингредиента: количество}) к спискам
+        пользователей user_ids; отрицательное количество вычитается.
+
+        Недостающие строки сначала вставляются с нулём, а конфликт с
+        уже существующей или параллельно вставленной строкой
+        игнорируется. Поэтому одновременные добавления одного
+        ингредиента не падают на уникальном ограничении, а UPDATE
+        складывает их под блокировкой строки.
+        """
+        amounts = {key: value for key, value in amounts.items() if value}
+        user_ids = sorted(set(user_ids))
+        if not amounts or not user_ids:
+            return
+        items = self.filter(user_id__in=user_ids, ingredient_id__in=amounts)
+        # Без точки сохранения: change вызывается из сигналов по строке
+        # на каждый удалённый ингредиент, а откатывать её отдельно
+        # от внешней транзакции не нужно.
+        with transaction.atomic(using=self.db, savepoint=False):
+            self.bulk_create((
+                self.model(user_id=user_id, ingredient_id=key,
+                           total_amount=0)
+                for user_id in user_ids
+                for key in sorted(amounts) if amounts[key] > 0
+            ), ignore_conflicts=True)
+            items.update(
+                total_amount=models.F('total_amount') + models.Case(
+                    *(models.When(ingredient_id=key, then=models.Value(value))
+                      for key, value in amounts.items()),
+                    output_field=models.IntegerField()
+                )
+            )
+            if min(amounts.values()) < 0:
+                items.filter(total_amount__lte=0).delete()
+
+    def add_recipe(self, user_ids, recipe):
+        self.change(user_ids, self.recipe_amounts(recipe))
+
+    def remove_recipe(self, user_ids, recipe):
+        self.change(user_ids, {
+            key: -value for key, value in self.recipe_amounts(recipe).items()
+        })
+
+    def expected(self, user_ids=None):
+        """Строки списка покупок, посчитанные заново по корзинам."""
+        rows = IngredientRecipe.objects.filter(
+            recipe__shopping_cart__isnull=False
+        )
+        if user_ids is not None:
+            rows = rows.filter(recipe__shopping_cart__user_id__in=user_ids)
+        return rows.values(
+            'recipe__shopping_cart__user', 'ingredient'
+        ).annotate(total=models.Sum('amount')).values_list(
+            'recipe__shopping_cart__user', 'ingredient', 'total'
+        )
+
+    @transaction.atomic
+    def rebuild(self, user_ids=None):
+        """Пересобирает списки покупок с нуля, возвращает число строк."""
+        items = self.all()
+        if user_ids is not None:
+            items = items.filter(user_id__in=user_ids)
+        items.delete()
+        rows = self.expected(user_ids).iterator()
+        count = 0
+        # Пачками, чтобы не держать всю таблицу в памяти: bulk_create
+        # превращает переданные объекты в список. SQLite принимает не
+        # больше 999 параметров и 500 строк в одном INSERT.
+        while True:
+            batch = [
+                self.model(user_id=user_id, ingredient_id=key,
+                           total_amount=value)
+                for user_id, key, value in islice(rows, 300)
+            ]
+            if not batch:
+                return count
+            self.bulk_create(batch)
+            count += len(batch)
+
+
+class ShoppingListItem(models.Model):
+    """Модель сводного списка покупок пользователя."""
+    user = models.ForeignKey(
+        User,
+        verbose_name='Пользователь',
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        verbose_name='Ингредиент',
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+    )
+    total_amount = models.IntegerField('Количество')
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Строки списка покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient', ),
+                name='unique_shopping_list_item'),
+        )
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.total_amount}'
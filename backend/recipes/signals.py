@@ -0,0 +1,245 @@
+import threading
+
+from django.db import connections, transaction
+from django.db.models import F
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+
+from users.models import Subscribe
+
+from .catalogue import bump_version
+from .images import schedule
+from .ingredient_index import schedule_change, schedule_changes
+from .models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                     ShoppingCart, ShoppingListItem, Tag, User)
+
+
+class Deleting(threading.local):
+    """Рецепты и ингредиенты, которые сейчас удаляются в этом потоке.
+
+    Каскадное удаление шлёт post_delete по каждой строке ингредиентов,
+    корзин и избранного. Для удаляемых рецептов и ингредиентов списки
+    покупок и индекс меняются заранее, в pre_delete, одним запросом,
+    а обработчики отдельных строк их пропускают.
+    """
+
+    def __init__(self):
+        self.recipes = set()
+        self.ingredients = set()
+
+
+deleting = Deleting()
+
+
+@receiver(post_migrate)
+def create_search_indexes(sender, using, **kwargs):
+    """Индексы для поиска в PostgreSQL.
+
+    Django ищет ингредиенты по istartswith/icontains через
+    UPPER("name"::text) LIKE, поэтому индексы строятся по тому же
+    выражению: btree для поиска по началу названия и GIN pg_trgm для
+    поиска по подстроке. Рецепты ищутся по GIN-индексу поискового вектора.
+    """
+    connection = connections[using]
+    if sender.name != 'recipes' or connection.vendor != 'postgresql':
+        return
+    table = Ingredient._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_prefix '
+            f'ON {table} (UPPER(name::text) text_pattern_ops)'
+        )
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+            f'ON {table} USING gin (UPPER(name::text) gin_trgm_ops)'
+        )
+        cursor.execute(
+            'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector '
+            f'ON {Recipe._meta.db_table} USING gin (search_vector)'
+        )
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def bump_tags_version(**kwargs):
+    transaction.on_commit(lambda: bump_version('tags'))
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def bump_ingredients_version(**kwargs):
+    transaction.on_commit(lambda: bump_version('ingredients'))
+
+
+@receiver(post_save, sender=Ingredient)
+def update_recipes_search_vector(instance, created, **kwargs):
+    if not created:
+        Recipe.objects.filter(ingredients=instance).update_search_vector()
+
+
+@receiver(pre_save, sender=Recipe)
+def reset_image_variants(instance, **kwargs):
+    if instance.image and not instance.image._committed:
+        instance.has_image_variants = False
+
+
+@receiver(post_save, sender=Recipe)
+def build_image_variants(instance, **kwargs):
+    if instance.image and not instance.has_image_variants:
+        schedule(instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_users_version(update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    transaction.on_commit(lambda: bump_version('users'))
+
+
+def change_counter(model, pk, field, created):
+    """Атомарно увеличивает или уменьшает счётчик field у записи pk."""
+    if created:
+        model.objects.filter(pk=pk).update(**{field: F(field) + 1})
+    else:
+        model.objects.filter(pk=pk, **{f'{field}__gt': 0}).update(
+            **{field: F(field) - 1}
+        )
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+def count_favorites(instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    if instance.recipe_id in deleting.recipes:
+        return
+    change_counter(Recipe, instance.recipe_id, 'favorites_count', created)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def count_recipes(instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    change_counter(User, instance.author_id, 'recipes_count', created)
+
+
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=Subscribe)
+def count_followers(instance, created=False, **kwargs):
+    if kwargs['signal'] is post_save and not created:
+        return
+    change_counter(User, instance.author_id, 'followers_count', created)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(instance, created, **kwargs):
+    if created:
+        ShoppingListItem.objects.add_recipe(
+            [instance.user_id], instance.recipe_id
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def remove_from_shopping_list(instance, **kwargs):
+    if instance.recipe_id in deleting.recipes:
+        return
+    ShoppingListItem.objects.remove_recipe(
+        [instance.user_id], instance.recipe_id
+    )
+
+
+def change_shopping_lists(recipe_id, amounts):
+    """Меняет списки покупок всех, у кого рецепт recipe_id в корзине."""
+    ShoppingListItem.objects.change(
+        ShoppingCart.objects.filter(recipe_id=recipe_id).values_list(
+            'user_id', flat=True
+        ),
+        amounts
+    )
+
+
+def is_deleting(row):
+    return (row.recipe_id in deleting.recipes
+            or row.ingredient_id in deleting.ingredients)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_recipe_rows(instance, **kwargs):
+    amounts = ShoppingListItem.objects.recipe_amounts(instance.pk)
+    change_shopping_lists(
+        instance.pk, {key: -value for key, value in amounts.items()}
+    )
+    schedule_change(instance.pk, removed=set(amounts))
+    deleting.recipes.add(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def forget_deleted_recipe(instance, **kwargs):
+    deleting.recipes.discard(instance.pk)
+
+
+@receiver(pre_delete, sender=Ingredient)
+def remove_ingredient_rows(instance, **kwargs):
+    # Строки списков покупок с ингредиентом удаляются каскадом.
+    recipe_ids = IngredientRecipe.objects.filter(
+        ingredient=instance
+    ).values_list('recipe_id', flat=True).distinct()
+    schedule_changes(
+        (recipe_id, (), (instance.pk, )) for recipe_id in recipe_ids
+    )
+    deleting.ingredients.add(instance.pk)
+
+
+@receiver(post_delete, sender=Ingredient)
+def forget_deleted_ingredient(instance, **kwargs):
+    deleting.ingredients.discard(instance.pk)
+
+
+@receiver(pre_save, sender=IngredientRecipe)
+def remember_ingredient_amount(instance, **kwargs):
+    instance.previous = None if instance.pk is None else (
+        IngredientRecipe.objects.filter(pk=instance.pk).values_list(
+            'recipe_id', 'ingredient_id', 'amount'
+        ).first()
+    )
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def update_shopping_lists(instance, **kwargs):
+    changes = {instance.recipe_id: {instance.ingredient_id: instance.amount}}
+    if instance.previous is not None:
+        recipe_id, ingredient_id, amount = instance.previous
+        amounts = changes.setdefault(recipe_id, {})
+        amounts[ingredient_id] = amounts.get(ingredient_id, 0) - amount
+    for recipe_id, amounts in changes.items():
+        change_shopping_lists(recipe_id, amounts)
+
+
+@receiver(post_delete, sender=IngredientRecipe)
+def subtract_from_shopping_lists(instance, **kwargs):
+    if is_deleting(instance):
+        return
+    change_shopping_lists(
+        instance.recipe_id, {instance.ingredient_id: -instance.amount}
+    )
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def add_to_ingredient_index(instance, **kwargs):
+    key = (instance.recipe_id, instance.ingredient_id)
+    if instance.previous is not None:
+        if instance.previous[:2] == key:
+            return
+        schedule_change(instance.previous[0], removed={instance.previous[1]})
+    schedule_change(instance.recipe_id, added={instance.ingredient_id})
+
+
+@receiver(post_delete, sender=IngredientRecipe)
+def remove_from_ingredient_index(instance, **kwargs):
+    if is_deleting(instance):
+        return
+    schedule_change(instance.recipe_id, removed={instance.ingredient_id})
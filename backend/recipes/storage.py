@@ -0,0 +1,58 @@
+"""Хранилище картинок рецептов с адресацией по содержимому.
+
+Файл сохраняется под именем sha256 своего содержимого
+(recipes/images/ab/ab….png), поэтому одинаковые картинки хранятся один
+раз, а повторно присланная картинка не записывается заново. Файлы, на
+которые больше не ссылается ни один рецепт, удаляет команда
+collect_images.
+"""
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    if isinstance(content, bytes):
+        digest.update(content)
+    else:
+        for chunk in content.chunks():
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_of(name):
+    """Хеш содержимого, записанный в имени файла name."""
+    return os.path.splitext(posixpath.basename(name))[0]
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        digest = content_hash(content)
+        directory, base = posixpath.split(name)
+        name = posixpath.join(
+            directory, digest[:2], digest + os.path.splitext(base)[1].lower()
+        )
+        if self.exists(name):
+            # Обновляем время изменения, чтобы collect_images не удалил
+            # файл, на который вот-вот сошлётся новый рецепт.
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
+
+    def save_derived(self, name, content):
+        """Сохраняет производный файл (например, уменьшенную копию)
+        под именем name, без адресации по содержимому."""
+        self.delete(name)
+        return super().save(name, content)
+
+
+image_storage = ContentAddressedStorage()
@@ -0,0 +1,242 @@
+import tempfile
+import time
+from unittest import mock
+
+from django.core.cache import cache
+from django.db import connection
+from django.test import (SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.test.utils import CaptureQueriesContext
+
+from foodgram.cache import FileBasedCache
+from users.models import User
+
+from .catalogue import bump_version, get_version
+from .ingredient_index import VERSION_NAME, IngredientIndex, ingredient_index
+from .models import (Ingredient, IngredientRecipe, Recipe, ShoppingCart,
+                     ShoppingListItem)
+
+# Тесты работают со своим кэшем в памяти, а не с общим файловым кэшем
+# запущенного сервера.
+TEST_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'versions': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'versions',
+        'TIMEOUT': None,
+    },
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ShoppingListTests(TestCase):
+    """Сводный список покупок совпадает с пересчитанным по корзинам при
+    любых изменениях через ORM, а не только через API."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Авторов', password='pass'
+        )
+        cls.buyer = User.objects.create_user(
+            email='buyer@example.com', username='buyer',
+            first_name='Покупатель', last_name='Покупателев', password='pass'
+        )
+        ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(4)
+        ]
+        for number in range(2):
+            recipe = Recipe.objects.create(
+                author=cls.author, name=f'Рецепт {number}', text='Текст',
+                image='recipes/images/test.png', has_image_variants=True,
+                cooking_time=10
+            )
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                                 amount=10 * (number + 1))
+                for ingredient in ingredients[number:number + 3]
+            )
+
+    def setUp(self):
+        # В Django 3.0 объекты из setUpTestData общие для всех тестов,
+        # а delete() обнуляет у них pk, поэтому берём свежие.
+        self.author = User.objects.get(pk=self.author.pk)
+        self.ingredients = list(Ingredient.objects.order_by('pk'))
+        self.recipes = list(Recipe.objects.order_by('pk'))
+        for recipe in self.recipes:
+            ShoppingCart.objects.create(user=self.buyer, recipe=recipe)
+
+    def assertListConsistent(self):
+        self.assertEqual(
+            set(ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )),
+            set(ShoppingListItem.objects.expected())
+        )
+
+    def test_cart_rows_update_list(self):
+        self.assertListConsistent()
+        self.assertEqual(ShoppingListItem.objects.get(
+            user=self.buyer, ingredient=self.ingredients[1]
+        ).total_amount, 30)
+        ShoppingCart.objects.filter(recipe=self.recipes[0]).delete()
+        self.assertListConsistent()
+
+    def test_recipe_delete_cascades_to_list(self):
+        self.recipes[0].delete()
+        self.assertListConsistent()
+        self.assertEqual(ShoppingListItem.objects.count(), 3)
+
+    def test_recipe_delete_queries_do_not_grow_with_rows(self):
+        with CaptureQueriesContext(connection) as first:
+            self.recipes[0].delete()
+        IngredientRecipe.objects.create(
+            recipe=self.recipes[1], ingredient=self.ingredients[0], amount=5
+        )
+        ShoppingCart.objects.create(user=self.author, recipe=self.recipes[1])
+        with CaptureQueriesContext(connection) as second:
+            self.recipes[1].delete()
+        self.assertEqual(len(second), len(first))
+        self.assertListConsistent()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_user_delete_cascades(self):
+        self.author.delete()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+    def test_ingredient_rows_edited_directly(self):
+        row = IngredientRecipe.objects.get(
+            recipe=self.recipes[0], ingredient=self.ingredients[0]
+        )
+        row.amount = 15
+        row.save()
+        self.assertListConsistent()
+        row.ingredient = self.ingredients[3]
+        row.save()
+        self.assertListConsistent()
+        row.delete()
+        self.assertListConsistent()
+        IngredientRecipe.objects.create(
+            recipe=self.recipes[1], ingredient=self.ingredients[0], amount=7
+        )
+        self.assertListConsistent()
+
+    def test_ingredient_delete_cascades(self):
+        self.ingredients[1].delete()
+        self.assertListConsistent()
+
+    def test_rebuild(self):
+        ShoppingListItem.objects.all().delete()
+        self.assertEqual(ShoppingListItem.objects.rebuild(), 4)
+        self.assertListConsistent()
+
+
+@override_settings(CACHES=TEST_CACHES)
+class IngredientIndexTests(TransactionTestCase):
+    """Индекс процесса обновляется на месте при любых изменениях строк
+    ингредиентов и совпадает с построенным заново."""
+
+    def setUp(self):
+        cache.clear()
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            first_name='Автор', last_name='Авторов', password='pass'
+        )
+        self.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        self.recipes = [
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Текст',
+                image='recipes/images/test.png', has_image_variants=True,
+                cooking_time=10
+            )
+            for number in range(2)
+        ]
+        for recipe in self.recipes:
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                                 amount=10)
+                for ingredient in self.ingredients[:2]
+            )
+        ingredient_index.version = None
+        ingredient_index.ensure_current()
+
+    def get_state(self, index):
+        return (
+            {key: list(value) for key, value in index.postings.items()
+             if value},
+            {key: value for key, value in enumerate(index.counts) if value}
+        )
+
+    def assertIndexPatched(self, index=ingredient_index):
+        self.assertEqual(index.version, get_version(VERSION_NAME))
+        fresh = IngredientIndex()
+        fresh.rebuild()
+        self.assertEqual(self.get_state(index), self.get_state(fresh))
+
+    def test_rows_edited_directly(self):
+        row = IngredientRecipe.objects.get(
+            recipe=self.recipes[0], ingredient=self.ingredients[0]
+        )
+        row.ingredient = self.ingredients[2]
+        row.save()
+        self.assertIndexPatched()
+        IngredientRecipe.objects.filter(recipe=self.recipes[1]).delete()
+        self.assertIndexPatched()
+        IngredientRecipe.objects.create(
+            recipe=self.recipes[1], ingredient=self.ingredients[2], amount=1
+        )
+        self.assertIndexPatched()
+
+    def test_cascades(self):
+        self.recipes[0].delete()
+        self.assertIndexPatched()
+        self.ingredients[1].delete()
+        self.assertIndexPatched()
+        self.assertEqual(self.get_state(ingredient_index), (
+            {self.ingredients[0].pk: [self.recipes[1].pk]},
+            {self.recipes[1].pk: 1}
+        ))
+
+    def test_other_worker_applies_deltas(self):
+        worker = IngredientIndex()
+        worker.ensure_current()
+        row = IngredientRecipe.objects.get(
+            recipe=self.recipes[0], ingredient=self.ingredients[0]
+        )
+        row.ingredient = self.ingredients[2]
+        row.save()
+        self.recipes[1].delete()
+        with mock.patch.object(worker, 'rebuild') as rebuild:
+            worker.ensure_current()
+        rebuild.assert_not_called()
+        self.assertIndexPatched(worker)
+
+    def test_concurrent_bump_makes_index_stale(self):
+        version = ingredient_index.version
+        bump_version(VERSION_NAME)
+        IngredientRecipe.objects.filter(recipe=self.recipes[1]).delete()
+        self.assertEqual(ingredient_index.version, version)
+        self.assertEqual(ingredient_index.match([self.ingredients[0].pk]),
+                         [(self.recipes[0].pk, 0.5)])
+
+
+class VersionCacheTests(SimpleTestCase):
+    """Номер версии после incr не истекает и не повторяется."""
+
+    def test_incr_keeps_value_without_timeout(self):
+        with tempfile.TemporaryDirectory() as location:
+            versions = FileBasedCache(location, {'TIMEOUT': 300})
+            with self.assertRaises(ValueError):
+                versions.incr('version')
+            versions.add('version', 1, timeout=None)
+            self.assertEqual(versions.incr('version'), 2)
+            self.assertEqual(versions.incr('version', 3), 5)
+            with mock.patch('time.time', return_value=time.time() + 3600):
+                self.assertEqual(versions.get('version'), 5)
@@ -24,6 +24,16 @@ class User(AbstractUser):
         'Фамилия',
         max_length=150
     )
+    recipes_count = models.PositiveIntegerField(
+        'Количество рецептов',
+        default=0,
+        editable=False
+    )
+    followers_count = models.PositiveIntegerField(
+        'Количество подписчиков',
+        default=0,
+        editable=False
+    )
 
     class Meta:
         ordering = ('id',)